@@ -0,0 +1,72 @@
+"""
+    Script to measure get_friend_suggestions on a synthetic friendship graph.
+    Run `python benchmark_friend_suggestions.py [edges] [users] [samples]` against a migrated database.
+
+    The graph is built inside a transaction that is rolled back at the end, so nothing is left behind.
+    Users are laid out on a ring and most friendships join users a short way apart, the way friend
+    circles overlap, with the rest between random users; that gives candidates with many mutual
+    friends as well as the long tail. Latency is reported for the query itself and for a cache hit.
+"""
+
+import random
+import sys
+from sqlalchemy import text
+import model
+from model import db
+import server
+import crud
+from benchmark_utils import create_synthetic_users, percentiles, timed, warm_up
+from extensions import friend_suggestion_cache
+
+# How far around the ring the local friendships reach.
+NEIGHBOURHOOD = 200
+
+
+edges = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+users = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+samples = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+model.connect_to_db(server.app, echo=False)
+
+with server.app.app_context():
+    try:
+        print(f"Creating {users} users")
+        user_ids = create_synthetic_users("suggest", users)
+
+        # Pairs are drawn with some room to spare, since self-pairs and duplicates are dropped.
+        print(f"Creating about {edges} friendships")
+        db.session.execute(text("""
+            INSERT INTO friendship (user1_id, user2_id)
+            SELECT least(ids[a], ids[b]), greatest(ids[a], ids[b])
+            FROM (
+                SELECT a, CASE WHEN random() < 0.8
+                    THEN 1 + (a + floor(random() * :neighbourhood)::int) % :users
+                    ELSE 1 + floor(random() * :users)::int
+                END AS b
+                FROM (SELECT 1 + floor(random() * :users)::int AS a FROM generate_series(1, :pairs)) AS drawn
+            ) AS pairs, (SELECT CAST(:ids AS integer[]) AS ids) AS lookup
+            WHERE a <> b
+            ON CONFLICT DO NOTHING
+        """), {"ids": user_ids, "users": len(user_ids), "neighbourhood": NEIGHBOURHOOD, "pairs": int(edges * 1.1)})
+        db.session.execute(text("ANALYZE friendship"))
+        db.session.execute(text("ANALYZE users"))
+
+        edge_count = db.session.execute(text("SELECT count(*) FROM friendship")).scalar()
+        print(f"Graph has {edge_count} friendships in total, about {2 * edge_count / len(user_ids):.0f} per synthetic user")
+
+        sample_ids = random.sample(user_ids, min(samples, len(user_ids)))
+        warm_up(lambda: crud.get_friend_suggestions(sample_ids[0]))
+
+        query_seconds = []
+        for user_id in sample_ids:
+            suggestions, seconds = timed(lambda: crud.get_friend_suggestions(user_id))
+            query_seconds.append(seconds)
+            friend_suggestion_cache.set(user_id, 10, suggestions, friend_suggestion_cache.version(user_id))
+
+        cached_seconds = [timed(lambda: friend_suggestion_cache.get(user_id, 10))[1] for user_id in sample_ids]
+
+        for name, seconds in (("query", query_seconds), ("cache hit", cached_seconds)):
+            p50, p95, slowest = percentiles(seconds)
+            print(f"{name:9} p50 {p50:.2f}ms  p95 {p95:.2f}ms  max {slowest:.2f}ms over {len(seconds)} users")
+    finally:
+        db.session.rollback()
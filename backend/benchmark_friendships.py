@@ -0,0 +1,59 @@
+"""
+    Script to compare check_friendship's canonical-pair lookup with the OR query it replaced.
+    Run `python benchmark_friendships.py [lookups]` against a migrated database (seeded data is enough).
+
+    Both lookups run over the same user pairs: existing friendships, asked for in either order,
+    and random pairs that are mostly not friends. The answers are compared too, since stored pairs
+    that aren't in canonical order would show up as friendships only the OR query finds.
+"""
+
+import random
+import sys
+from sqlalchemy import select, or_, and_
+import model
+from model import db, User, Friends
+import server
+import crud
+from benchmark_utils import timed, warm_up
+
+
+def or_lookup(user1_id, user2_id):
+    """The lookup check_friendship did before friendships were stored lower id first."""
+    return db.session.execute(
+        select(Friends.id).where(or_(
+            and_(Friends.user1_id == user1_id, Friends.user2_id == user2_id),
+            and_(Friends.user1_id == user2_id, Friends.user2_id == user1_id)
+        ))
+    ).first() is not None
+
+
+def time_lookups(lookup, pairs):
+    """Return the answers for every pair and the seconds they took."""
+    return timed(lambda: [lookup(user1_id, user2_id) for user1_id, user2_id in pairs])
+
+
+lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+model.connect_to_db(server.app, echo=False)
+
+with server.app.app_context():
+    edges = db.session.execute(select(Friends.user1_id, Friends.user2_id).limit(lookups // 2)).all()
+    user_ids = db.session.execute(select(User.id)).scalars().all()
+    if not edges or len(user_ids) < 2:
+        sys.exit("No friendships found; seed the database first.")
+
+    pairs = [(user2_id, user1_id) if random.random() < 0.5 else (user1_id, user2_id) for user1_id, user2_id in edges]
+    pairs += [tuple(random.sample(user_ids, 2)) for _ in range(lookups - len(pairs))]
+    random.shuffle(pairs)
+
+    warm_up(lambda: time_lookups(crud.check_friendship, pairs[:100]), lambda: time_lookups(or_lookup, pairs[:100]))
+
+    canonical_answers, canonical_seconds = time_lookups(crud.check_friendship, pairs)
+    or_answers, or_seconds = time_lookups(or_lookup, pairs)
+
+    for name, seconds in (("canonical", canonical_seconds), ("or query", or_seconds)):
+        print(f"{name:10} {len(pairs)} lookups in {seconds:.3f}s, {seconds / len(pairs) * 1e6:.0f}us each")
+
+    mismatches = sum(canonical != other for canonical, other in zip(canonical_answers, or_answers))
+    if mismatches:
+        sys.exit(f"{mismatches} pairs answered differently; are all friendships stored in canonical order?")
@@ -0,0 +1,113 @@
+"""
+    Script to compare the single-statement crud mutations with the get-then-commit ORM paths they replaced.
+    Run `python benchmark_mutations.py [operations]` against a migrated database (seeded data is enough).
+
+    The mutations run on a throwaway user and their products, which are deleted again at the end. Each
+    one is timed through the ORM (load the row, change it in Python, commit) and through the crud
+    function's UPDATE or DELETE ... RETURNING, and reports its latency and the statements it sent per call.
+"""
+
+import secrets
+import sys
+from sqlalchemy import event, select
+import model
+from model import db, User, Products
+import server
+import crud
+from benchmark_utils import percentiles, timed, warm_up
+
+
+def orm_update_user_description(user_id, description):
+    """update_user_description before RETURNING: load the user, set the description, commit."""
+    user = User.query.get(user_id)
+    user.description = description
+    db.session.commit()
+    return user
+
+
+def orm_toggle_favorited(product_id, user_id):
+    """toggle_favorited before RETURNING: the route's ownership lookup, then the flag flipped in Python."""
+    product = Products.query.filter_by(user_id=user_id, id=product_id).first()
+    product.favorited = not product.favorited
+    db.session.commit()
+    return product
+
+
+def orm_update_product(product_id, user_id, **kwargs):
+    """update_product before RETURNING: the route's ownership lookup, then each field set in Python."""
+    product = Products.query.filter_by(user_id=user_id, id=product_id).first()
+    for key, value in kwargs.items():
+        setattr(product, key, value)
+    db.session.commit()
+    return product
+
+
+def orm_delete_product(product_id, user_id):
+    """delete_product before RETURNING: the route's ownership lookup, then a session delete."""
+    product = Products.query.filter_by(user_id=user_id, id=product_id).first()
+    db.session.delete(product)
+    db.session.commit()
+    return True
+
+
+def run(fn, calls):
+    """Make each call of fn from an empty session and return the seconds each took and the statements sent in all."""
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        sent.append(statement)
+
+    seconds = []
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        for args in calls:
+            db.session.expunge_all()
+            seconds.append(timed(lambda: fn(*args))[1])
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return seconds, len(sent)
+
+
+operations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+model.connect_to_db(server.app, echo=False)
+
+with server.app.app_context():
+    tag = secrets.token_hex(4)
+    user_id = crud.create_user(f"bench_mutations_{tag}", f"bench_mutations_{tag}@example.com", secrets.token_hex(8)).id
+    try:
+        # Without categories the products have no links or aggregates, which the ORM paths never maintained.
+        rows = [
+            dict(url=f"https://example.com/benchmark/{i}", price=1.0, productName=f"Benchmark product {i}", category=[], favorited=False)
+            for i in range(2 * operations)
+        ]
+        for start in range(0, len(rows), 500):
+            crud.bulk_create_products(user_id, rows[start:start + 500])
+        product_ids = db.session.execute(select(Products.id).where(Products.user_id == user_id).order_by(Products.id)).scalars().all()
+        orm_ids, core_ids = product_ids[:operations], product_ids[operations:]
+
+        mutations = (
+            ("update_user_description", orm_update_user_description, crud.update_user_description,
+                [(user_id, f"Benchmark {i}") for i in range(operations)], [(user_id, f"Benchmark {i}") for i in range(operations)]),
+            ("toggle_favorited", orm_toggle_favorited, crud.toggle_favorited,
+                [(product_id, user_id) for product_id in orm_ids], [(product_id, user_id) for product_id in core_ids]),
+            ("update_product", lambda product_id, user_id: orm_update_product(product_id, user_id, productName="Renamed"),
+                lambda product_id, user_id: crud.update_product(product_id, user_id, productName="Renamed"),
+                [(product_id, user_id) for product_id in orm_ids], [(product_id, user_id) for product_id in core_ids]),
+            ("delete_product", orm_delete_product, crud.delete_product,
+                [(product_id, user_id) for product_id in orm_ids], [(product_id, user_id) for product_id in core_ids]),
+        )
+
+        warm_up(
+            lambda: run(orm_toggle_favorited, [(product_id, user_id) for product_id in orm_ids[:20]]),
+            lambda: run(crud.toggle_favorited, [(product_id, user_id) for product_id in core_ids[:20]]),
+        )
+
+        for name, orm_fn, core_fn, orm_calls, core_calls in mutations:
+            for path, fn, calls in (("ORM", orm_fn, orm_calls), ("RETURNING", core_fn, core_calls)):
+                seconds, statements = run(fn, calls)
+                p50, p95, slowest = percentiles(seconds)
+                print(f"{name:24} {path:9} p50 {p50:.2f}ms  p95 {p95:.2f}ms  max {slowest:.2f}ms"
+                      f"  {statements / len(calls):.1f} statements per call")
+    finally:
+        crud.delete_user_account(user_id)
@@ -0,0 +1,97 @@
+"""
+    Script to compare the column-projected product paths with the ORM entity paths they replaced.
+    Run `python benchmark_product_reads.py [products] [pages]` against a migrated database (seeded data is enough).
+
+    Products are inserted for a throwaway user, once a row at a time through the ORM and once with
+    bulk_create_products, and the user is deleted again at the end. Listing pages and the full export
+    are then read both as ORM entities passed through to_dict() and as plain rows passed through
+    Products.serialize_row. Each path reports rows per second and the peak Python memory it allocated.
+"""
+
+import random
+import secrets
+import sys
+from sqlalchemy import select
+import model
+from model import db, Products
+import server
+import crud
+from benchmark_utils import measure, warm_up
+
+CATEGORIES = [["Gadgets"], ["Tools"], ["Electronics", "Accessories"], ["Home"], ["Tools", "Home"], []]
+
+
+def report(name, rows, seconds, peak):
+    print(f"{name:28} {rows / seconds:10.0f} rows/s  peak {peak / 1024:8.0f} KiB  ({rows} rows in {seconds:.3f}s)")
+
+
+def product_rows(count):
+    return [
+        dict(url=f"https://example.com/benchmark/{i}", price=round(random.uniform(1, 500), 2),
+             productName=f"Benchmark product {i}", category=random.choice(CATEGORIES), favorited=i % 10 == 0)
+        for i in range(count)
+    ]
+
+
+def orm_insert(user_id, rows):
+    """The import path before bulk_create_products: one create_product, and one commit, per row."""
+    for row in rows:
+        crud.create_product(user_id, row["url"], row["price"], row["productName"], row["category"], row["favorited"])
+    return len(rows)
+
+
+def bulk_insert(user_id, rows, batch_size=500):
+    return sum(crud.bulk_create_products(user_id, rows[start:start + batch_size]) for start in range(0, len(rows), batch_size))
+
+
+def orm_pages(user_id, pages, limit):
+    """Listing pages the way they were read before list_products: ORM entities, then to_dict()."""
+    served = 0
+    for page in range(pages):
+        products = Products.query.filter_by(user_id=user_id).order_by(Products.id.desc()).limit(limit).offset(page * limit).all()
+        served += len([product.to_dict() for product in products])
+    return served
+
+
+def core_pages(user_id, pages, limit):
+    served = 0
+    for page in range(pages):
+        products, _, _ = crud.list_products(user_id, limit=limit, offset=page * limit)
+        served += len([Products.serialize_row(product) for product in products])
+    return served
+
+
+def orm_export(user_id):
+    """The export before iter_product_rows: every entity loaded into a list at once."""
+    products = db.session.execute(select(Products).where(Products.user_id == user_id).order_by(Products.id)).scalars().all()
+    return sum(1 for product in products if product.to_dict())
+
+
+def core_export(user_id):
+    return sum(1 for row in crud.iter_product_rows(user_id) if Products.serialize_row(row))
+
+
+product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+pages = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+limit = 50
+
+model.connect_to_db(server.app, echo=False)
+
+with server.app.app_context():
+    tag = secrets.token_hex(4)
+    orm_user_id = crud.create_user(f"bench_orm_{tag}", f"bench_orm_{tag}@example.com", secrets.token_hex(8)).id
+    bulk_user_id = crud.create_user(f"bench_bulk_{tag}", f"bench_bulk_{tag}@example.com", secrets.token_hex(8)).id
+    try:
+        rows = product_rows(product_count)
+        report("insert: create_product", *measure(lambda: orm_insert(orm_user_id, rows)))
+        report("insert: bulk_create_products", *measure(lambda: bulk_insert(bulk_user_id, rows)))
+
+        warm_up(lambda: core_pages(bulk_user_id, 5, limit), lambda: orm_pages(bulk_user_id, 5, limit))
+
+        report(f"pages of {limit}: ORM", *measure(lambda: orm_pages(bulk_user_id, pages, limit)))
+        report(f"pages of {limit}: list_products", *measure(lambda: core_pages(bulk_user_id, pages, limit)))
+        report("export: ORM", *measure(lambda: orm_export(bulk_user_id)))
+        report("export: iter_product_rows", *measure(lambda: core_export(bulk_user_id)))
+    finally:
+        crud.delete_user_account(orm_user_id)
+        crud.delete_user_account(bulk_user_id)
@@ -0,0 +1,78 @@
+"""
+    Script to measure list_products searches on a synthetic product catalogue.
+    Run `python benchmark_product_search.py [products] [users] [samples]` against a migrated database.
+
+    The catalogue is built inside a transaction that is rolled back at the end, so nothing is left behind.
+    Half of the products go to one heavy user and the rest are spread over the other users, so the
+    searches cover both a large listing and typical ones. Product names and urls are drawn from a
+    small vocabulary, so common words match many products and rare pairs match few.
+    Latency is reported for relevance-ordered and price-ordered searches.
+"""
+
+import random
+import sys
+from sqlalchemy import text
+import model
+from model import db
+import server
+import crud
+from benchmark_utils import create_synthetic_users, percentiles, timed, warm_up
+
+VOCABULARY = [
+    "widget", "gadget", "lamp", "chair", "desk", "monitor", "keyboard", "mouse", "cable", "charger",
+    "speaker", "headphones", "camera", "tripod", "backpack", "bottle", "mug", "kettle", "blender", "toaster",
+    "drill", "hammer", "wrench", "saw", "ladder", "tent", "lantern", "jacket", "boots", "gloves",
+    "wireless", "portable", "compact", "premium", "steel", "wooden", "smart", "vintage", "ergonomic", "solar",
+]
+SHOPS = ["amazon", "ebay", "etsy", "walmart", "target", "bestbuy", "ikea", "rei"]
+
+
+def time_searches(user_ids, terms, **options):
+    """Run one search per user with a random term and return the seconds each took."""
+    return [timed(lambda: crud.list_products(user_id, search=random.choice(terms), **options))[1] for user_id in user_ids]
+
+
+product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+user_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+samples = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+model.connect_to_db(server.app, echo=False)
+
+with server.app.app_context():
+    try:
+        print(f"Creating {user_count} users")
+        user_ids = create_synthetic_users("search", user_count)
+        heavy_user_id, other_user_ids = user_ids[0], user_ids[1:]
+
+        # The products_search_vector_update trigger fills search_vector as the rows go in.
+        print(f"Creating {product_count} products")
+        db.session.execute(text("""
+            INSERT INTO products (user_id, url, price, "productName", category, favorited, primary_category)
+            SELECT
+                CASE WHEN g % 2 = 0 THEN :heavy ELSE (CAST(:others AS integer[]))[1 + g % :other_count] END,
+                'https://' || (CAST(:shops AS text[]))[1 + floor(random() * :shop_count)::int] || '.example.com/'
+                    || (CAST(:words AS text[]))[1 + floor(random() * :word_count)::int] || '-' || g,
+                round((random() * 500)::numeric, 2),
+                (CAST(:words AS text[]))[1 + floor(random() * :word_count)::int] || ' '
+                    || (CAST(:words AS text[]))[1 + floor(random() * :word_count)::int] || ' '
+                    || (CAST(:words AS text[]))[1 + floor(random() * :word_count)::int],
+                '[]'::jsonb, random() < 0.1, ''
+            FROM generate_series(1, :products) AS g
+        """), {
+            "heavy": heavy_user_id, "others": other_user_ids, "other_count": len(other_user_ids),
+            "shops": SHOPS, "shop_count": len(SHOPS), "words": VOCABULARY, "word_count": len(VOCABULARY),
+            "products": product_count,
+        })
+        db.session.execute(text("ANALYZE products"))
+
+        terms = VOCABULARY + [f"{a} {b}" for a, b in zip(VOCABULARY, reversed(VOCABULARY))] + SHOPS
+        typical_ids = random.sample(other_user_ids, min(samples, len(other_user_ids)))
+        heavy_ids = [heavy_user_id] * samples
+        warm_up(lambda: time_searches(typical_ids[:10], terms))
+
+        for listing, sample_ids in (("heavy user", heavy_ids), ("typical user", typical_ids)):
+            for name, options in (("by relevance", {}), ("by price", {"sort_by": "price"})):
+                p50, p95, slowest = percentiles(time_searches(sample_ids, terms, **options))
+                print(f"{listing:12} {name:12} p50 {p50:.2f}ms  p95 {p95:.2f}ms  max {slowest:.2f}ms over {len(sample_ids)} searches")
+    finally:
+        db.session.rollback()
@@ -0,0 +1,56 @@
+"""Setup and timing helpers shared by the benchmark_*.py scripts."""
+
+import secrets
+import statistics
+import time
+import tracemalloc
+from sqlalchemy import text
+from model import db
+
+
+def create_synthetic_users(prefix, count):
+    """Insert `count` throwaway users named `<prefix>_<tag>_<n>` and return their ids in ascending order.
+
+    Nothing is committed; the scripts roll the rows back when they are done.
+    """
+    user_ids = db.session.execute(text("""
+        INSERT INTO users (username, email, password, description, "isOnline")
+        SELECT :prefix || '_' || g, :prefix || '_' || g || '@example.com', 'x', '', false
+        FROM generate_series(1, :count) AS g
+        ORDER BY g
+        RETURNING id
+    """), {"prefix": f"{prefix}_{secrets.token_hex(4)}", "count": count}).scalars().all()
+    return sorted(user_ids)
+
+
+def warm_up(*fns):
+    """Call each fn once so no measured path pays for the first reads into the buffer cache."""
+    for fn in fns:
+        fn()
+
+
+def timed(fn):
+    """Call fn and return its result and the seconds it took."""
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def measure(fn):
+    """Call fn and return its result, the seconds it took and the peak memory it allocated in bytes."""
+    db.session.expunge_all()
+    tracemalloc.start()
+    result, seconds = timed(fn)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def percentiles(seconds):
+    """Return the p50, p95 and max of a list of timings, in milliseconds."""
+    ordered = sorted(seconds)
+    return (
+        statistics.median(ordered) * 1000,
+        ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        ordered[-1] * 1000,
+    )
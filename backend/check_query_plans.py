@@ -0,0 +1,135 @@
+"""
+    Script to check that the hot crud queries are served by an index.
+    Run `python check_query_plans.py` against a migrated database (seeded data is enough).
+
+    Each crud read is called while its SQL is captured, then the captured statements are run
+    through EXPLAIN with sequential scans disabled. On small tables Postgres would rightly prefer
+    a sequential scan, so this checks that a usable index exists for each query rather than
+    what the planner picks on production-sized data.
+
+    Checks listed in QUERY_BUDGETS also fail if they send more statements than their budget,
+    which catches a query per row creeping back in however many rows the seeded user has.
+    Seed with SEED_CROWD=1 for the friend list budgets to run over a couple of thousand rows.
+    The mutation checks hold each write to its single UPDATE or DELETE ... RETURNING. They work
+    on a scratch user and product, which are deleted at the end, and write other rows back unchanged.
+    Exits non-zero if any plan still scans a table or any budget is exceeded.
+"""
+
+import secrets
+import sys
+from sqlalchemy import event
+import model
+from model import db, User, FriendRequest
+import server
+import crud
+from routes import friends as friends_routes
+
+
+QUERY_BUDGETS = {
+    "friends list": 1,
+    "pending friend requests": 1,
+    "get_relationship_state": 1,
+    "get_profile": 1,
+    "get_friend_suggestions": 1,
+    "update_user_description": 1,
+    "clear_reset_code": 1,
+    "update_friend_request": 1,
+    "toggle_favorited": 1,
+    "update_product": 1,
+    "delete_product": 1,
+}
+
+
+def plan_nodes(plan):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan tree."""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def capture_statements(fn):
+    """Call fn and return the (statement, parameters) pairs it sent to the database."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    return statements
+
+
+model.connect_to_db(server.app, echo=False)
+
+with server.app.app_context():
+    user = User.query.first()
+    if not user:
+        sys.exit("No users found; seed the database first.")
+    user_id = user.id
+    user_payload = {"user_id": user.id, "username": user.username}
+    # Plain values, since the mutations commit and reading an expired attribute would add a statement.
+    description = user.description
+    friend_request = db.session.execute(db.select(FriendRequest.id, FriendRequest.status).limit(1)).first()
+    # Created up front so the mutation checks only capture their own statements; without categories the product has no aggregates to update.
+    scratch_tag = secrets.token_hex(4)
+    scratch_user_id = crud.create_user(f"plan_check_{scratch_tag}", f"plan_check_{scratch_tag}@example.com", secrets.token_hex(8)).id
+    scratch_id = crud.create_product(scratch_user_id, "https://example.com/query-plan-check", 1.0, "Query plan check", []).id
+
+    checks = {
+        "list_products": lambda: crud.list_products(user_id),
+        "list_products sorted by price": lambda: crud.list_products(user_id, sort_by="price", extra_sort_by="descending"),
+        "list_products sorted by favorited": lambda: crud.list_products(user_id, sort_by="favorited"),
+        "list_products sorted by category": lambda: crud.list_products(user_id, sort_by="category"),
+        "list_products filtered by category": lambda: crud.list_products(user_id, category_filter=["Gadgets", "Tools"]),
+        "list_products searched": lambda: crud.list_products(user_id, search="widget"),
+        "list_products searched by price": lambda: crud.list_products(user_id, search="widget gadget", sort_by="price"),
+        "list_products within a price range": lambda: crud.list_products(user_id, min_price=1, max_price=100),
+        "count_products": lambda: crud.count_products(user_id),
+        "get_favorited_products": lambda: crud.get_favorited_products(user_id),
+        "get_friend_ids": lambda: crud.get_friend_ids(user_id),
+        "check_friendship": lambda: crud.check_friendship(user_id, user_id + 1),
+        "get_friend_requests": lambda: crud.get_friend_requests(receiver_id=user_id, status="pending"),
+        "friends list": lambda: friends_routes.get_friends(user_payload),
+        "pending friend requests": lambda: friends_routes.get_friend_requests(user_payload),
+        "get_relationship_state": lambda: crud.get_relationship_state(user_id, user_id + 1),
+        "get_profile": lambda: crud.get_profile(user_id + 1, user.username),
+        "get_friend_suggestions": lambda: crud.get_friend_suggestions(user_id),
+        "get_community_messages": lambda: crud.get_community_messages(),
+        "get_community_message_version": lambda: crud.get_community_message_version(),
+        "update_user_description": lambda: crud.update_user_description(user_id, description),
+        "clear_reset_code": lambda: crud.clear_reset_code(scratch_user_id),
+        "toggle_favorited": lambda: crud.toggle_favorited(scratch_id, scratch_user_id),
+        "update_product": lambda: crud.update_product(scratch_id, scratch_user_id, productName="Query plan check, renamed"),
+        "delete_product": lambda: crud.delete_product(scratch_id, scratch_user_id),
+    }
+    if friend_request:
+        checks["update_friend_request"] = lambda: crud.update_friend_request(friend_request.id, friend_request.status)
+
+    failed = False
+    try:
+        for name, fn in checks.items():
+            statements = capture_statements(fn)
+
+            budget = QUERY_BUDGETS.get(name)
+            if budget is not None and len(statements) > budget:
+                failed = True
+                print(f"FAIL {name}: {len(statements)} statements, budget is {budget}")
+
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql("SET enable_seqscan = off")
+                for statement, parameters in statements:
+                    plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()[0]["Plan"]
+                    scanned = sorted({node["Relation Name"] for node in plan_nodes(plan) if node["Node Type"] == "Seq Scan"})
+                    if scanned:
+                        failed = True
+                        print(f"FAIL {name}: sequential scan on {', '.join(scanned)}")
+                        print(f"    {statement}")
+                    else:
+                        print(f"ok   {name}")
+    finally:
+        crud.delete_user_account(scratch_user_id)
+
+    sys.exit(1 if failed else 0)
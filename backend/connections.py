@@ -0,0 +1,133 @@
+"""Registry of this worker's Socket.IO connections, with reaping of dead ones."""
+
+import logging
+import os
+import threading
+import time
+
+
+def process_rss_bytes():
+    """Return this process's resident memory in bytes, or None where it can't be read."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class ConnectionRegistry:
+    """
+    Socket.IO connections open on this worker and when each last showed signs of life.
+
+    Heartbeats and authenticated events refresh a connection. Every reap_interval
+    seconds a background task disconnects connections quiet for longer than
+    idle_timeout, and connections that never authenticated after anonymous_timeout.
+    Engine.IO pings already close dead transports. This catches sockets whose
+    transport is alive but whose page stopped running the app, such as a frozen tab,
+    and sockets opened without a login.
+    """
+
+    def __init__(self, idle_timeout=90, anonymous_timeout=60, reap_interval=30):
+        self.idle_timeout = idle_timeout
+        self.anonymous_timeout = anonymous_timeout
+        self.reap_interval = reap_interval
+        self.socketio = None
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._baseline_rss = None
+        self.opened_total = 0
+        self.reaped_total = 0
+
+    def init_app(self, app):
+        self.idle_timeout = app.config.get("SOCKET_IDLE_TIMEOUT", self.idle_timeout)
+        self.anonymous_timeout = app.config.get("SOCKET_ANONYMOUS_TIMEOUT", self.anonymous_timeout)
+        self.reap_interval = app.config.get("SOCKET_REAP_INTERVAL", self.reap_interval)
+
+    def start(self, socketio):
+        """Start the background task that reaps stale connections."""
+        if self._running:
+            return
+        self.socketio = socketio
+        self._running = True
+        # Memory in use before any sockets connect, so stats() can estimate the cost of each one.
+        self._baseline_rss = process_rss_bytes()
+        socketio.start_background_task(self._run)
+
+    def opened(self, sid, user=None):
+        """Register a new connection, with the token payload of its user if it sent a valid one."""
+        now = time.monotonic()
+        with self._lock:
+            self._connections[sid] = {
+                "user_id": user["user_id"] if user else None,
+                "username": user["username"] if user else None,
+                "connected_at": now,
+                "last_seen": now,
+                "events": 0,
+            }
+            self.opened_total += 1
+
+    def touched(self, sid, user=None):
+        """Record activity on a connection, attaching its user if it wasn't known yet."""
+        with self._lock:
+            connection = self._connections.get(sid)
+            if connection is None:
+                return
+            connection["last_seen"] = time.monotonic()
+            connection["events"] += 1
+            if user and connection["user_id"] is None:
+                connection["user_id"] = user["user_id"]
+                connection["username"] = user["username"]
+
+    def closed(self, sid):
+        """Unregister a connection and return what was known about it, or None."""
+        with self._lock:
+            return self._connections.pop(sid, None)
+
+    def __contains__(self, sid):
+        with self._lock:
+            return sid in self._connections
+
+    def stale(self):
+        """Return the sids of connections that are due to be reaped."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                sid for sid, connection in self._connections.items()
+                if now - connection["last_seen"] > self.idle_timeout
+                or (connection["user_id"] is None and now - connection["connected_at"] > self.anonymous_timeout)
+            ]
+
+    def reap(self):
+        """Disconnect every stale connection; the disconnect handler cleans up after each."""
+        for sid in self.stale():
+            self.reaped_total += 1
+            logging.info("Reaping idle socket %s", sid)
+            self.socketio.server.disconnect(sid, namespace="/")
+
+    def stats(self):
+        """Return connection counts and an estimate of the memory each connection costs."""
+        rss = process_rss_bytes()
+        with self._lock:
+            connected = len(self._connections)
+            user_ids = [connection["user_id"] for connection in self._connections.values() if connection["user_id"] is not None]
+            stats = {
+                "connected": connected,
+                "authenticated": len(user_ids),
+                "users": len(set(user_ids)),
+                "openedTotal": self.opened_total,
+                "reapedTotal": self.reaped_total,
+                "rssBytes": rss,
+                "rssBytesPerConnection": None,
+            }
+        if rss is not None and self._baseline_rss is not None and connected:
+            stats["rssBytesPerConnection"] = max(rss - self._baseline_rss, 0) // connected
+        return stats
+
+    def _run(self):
+        while self._running:
+            self.socketio.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except Exception:
+                logging.exception("Failed to reap idle sockets")
@@ -1,13 +1,17 @@
 """CRUD operations."""
 
-from model import User, Products, Friends, FriendRequest, CommunityMessage, db
-from sqlalchemy import or_, and_, asc, desc, cast
-from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import joinedload
+from model import User, Products, Category, product_categories, UserCategoryStats, Friends, FriendRequest, CommunityMessage, CommunityMessageVersion, db
+from extensions import product_listing_cache, community_message_buffer, friend_id_cache, friend_suggestion_cache, presence_registry
+from sqlalchemy import asc, desc, literal, literal_column, tuple_, insert, select, update, delete, exists, values, column, case
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
+from sqlalchemy.orm import aliased
 
 from werkzeug.security import generate_password_hash, check_password_hash
+import base64
+import json
 import secrets
 from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 
 # -- User Operations --
 
@@ -33,11 +37,14 @@ def get_user(**filters):
 
 
 def update_user_description(user_id, description):
-    """Update user description"""
-    user = User.query.get(user_id)
-    if not user:
-        return None
-    user.description = description
+    """Update user description. Returns the updated user row, or None if there is no such user."""
+    user = db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(description=description)
+        .returning(User.id, User.username, User.description)
+        .execution_options(synchronize_session=False)
+    ).first()
     db.session.commit()
     return user
 
@@ -70,13 +77,15 @@ def validate_reset_code(user_id, provided_code):
 
 def clear_reset_code(user_id):
     """Remove the reset code after successful password reset."""
-    user = User.query.get(user_id)
-    if not user:
-        return False
-    user.reset_code_hash = None
-    user.reset_code_expiry = None
+    cleared = db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(reset_code_hash=None, reset_code_expiry=None)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
+    ).first()
     db.session.commit()
-    return True
+    return cleared is not None
 
 def request_new_reset_code(username, email):
     """Regenerate and send a new reset code if requested."""
@@ -110,14 +119,31 @@ def delete_user(user_id):
         db.session.commit()
     return user is not None
 
-def set_user_online_status(user_id, new_status):
-    """Toggles the mode for the user (online/offline) and updates the database."""
-    user = User.query.get(user_id)
-    if not user:
-        return None
-    user.isOnline = new_status
-    db.session.commit()  
-    return user
+def get_user_online_status(user_id):
+    """Return the user's saved online flag, or None if the user doesn't exist."""
+    return db.session.execute(select(User.isOnline).where(User.id == user_id)).scalar()
+
+def get_pending_request_count(user_id):
+    """Return how many pending friend requests the user has received, from the maintained counter."""
+    return db.session.execute(select(User.pending_request_count).where(User.id == user_id)).scalar() or 0
+
+def save_online_statuses(statuses):
+    """
+    Write many users' online flags in one UPDATE.
+
+    Parameters:
+        statuses (dict): Online flag by user ID.
+    """
+    if not statuses:
+        return
+    rows = values(column("id", db.Integer), column("online", db.Boolean), name="statuses").data(list(statuses.items()))
+    db.session.execute(
+        update(User)
+        .where(User.id == rows.c.id)
+        .values(isOnline=rows.c.online)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
 
 def delete_user_account(user_id):
 
@@ -133,12 +159,34 @@ def delete_user_account(user_id):
             "content": db.func.concat("Deleted User: ", db.func.coalesce(CommunityMessage.content, ""))
         })
         print(f"Updated {updated_messages} community messages for user {user_id}")
+        if updated_messages:
+            bump_community_message_version()
+            community_message_buffer.invalidate()
  
+        # Requests the user sent are about to go, so take them off their receivers' counters first
+        pending_sent = (
+            select(FriendRequest.receiver_id, db.func.count().label("requests"))
+            .where(FriendRequest.sender_id == user_id, FriendRequest.status == "pending")
+            .group_by(FriendRequest.receiver_id)
+            .subquery()
+        )
+        pending_request_counts = dict(db.session.execute(
+            update(User)
+            .where(User.id == pending_sent.c.receiver_id)
+            .values(pending_request_count=db.func.greatest(User.pending_request_count - pending_sent.c.requests, 0))
+            .returning(User.id, User.pending_request_count)
+            .execution_options(synchronize_session=False)
+        ).all())
+
         deleted_friend_requests = FriendRequest.query.filter(
             (FriendRequest.sender_id == user_id) | (FriendRequest.receiver_id == user_id)
         ).delete(synchronize_session="fetch")
         print(f"Deleted {deleted_friend_requests} friend requests for user {user_id}")
 
+        # The user drops out of their friends' suggestions as a mutual friend, and out of their friends' friends' as a candidate
+        friend_ids = _friend_ids_of([user_id])
+        suggestion_user_ids = {user_id} | friend_ids | _friend_ids_of(friend_ids)
+
         deleted_friendships = Friends.query.filter(
             (Friends.user1_id == user_id) | (Friends.user2_id == user_id)
         ).delete(synchronize_session="fetch")
@@ -151,9 +199,14 @@ def delete_user_account(user_id):
         
         db.session.delete(user)
         db.session.commit()
+        product_listing_cache.invalidate(user_id)
+        friend_id_cache.remove_user(user_id)
+        for suggestion_user_id in suggestion_user_ids:
+            friend_suggestion_cache.invalidate(suggestion_user_id)
+        presence_registry.forget(user_id)
         
         print(f"Successfully deleted user: {user_id}")
-        return {"message": "User account deleted successfully."}
+        return {"success": True, "message": "User account deleted successfully.", "pending_request_counts": pending_request_counts}
     except Exception as e:
         db.session.rollback()
         print(f"Error while deleting user {user_id}: {e}")
@@ -161,6 +214,144 @@ def delete_user_account(user_id):
 
 # -- Product Operations --
 
+PRODUCT_COLUMNS = (Products.id, Products.url, Products.price, Products.productName, Products.category, Products.favorited)
+# Listings also select the category sort key, which encode_product_cursor reads off the last row.
+LISTING_COLUMNS = PRODUCT_COLUMNS + (Products.primary_category,)
+
+def _primary_category(categories):
+    """Return the key a product is ordered by when sorting by category."""
+    return categories[0][:100].lower() if categories else ""
+
+def _category_ids(names):
+    """Return a name -> id mapping for the given categories, creating any that don't exist yet."""
+    names = sorted({name[:100] for name in names})
+    if not names:
+        return {}
+    db.session.execute(
+        pg_insert(Category).values([{"name": name} for name in names]).on_conflict_do_nothing(index_elements=["name"])
+    )
+    return dict(db.session.execute(select(Category.name, Category.id).where(Category.name.in_(names))).all())
+
+def _link_product_categories(categories_by_product, replace=False):
+    """
+    Link products to their categories in product_categories. Doesn't commit.
+
+    Parameters:
+        categories_by_product (dict): Product id -> list of category names.
+        replace (bool): Remove the products' existing links first.
+    """
+    if replace:
+        db.session.execute(
+            delete(product_categories).where(product_categories.c.product_id.in_(list(categories_by_product)))
+        )
+
+    category_ids = _category_ids(name for names in categories_by_product.values() for name in names)
+    links = [
+        {"product_id": product_id, "category_id": category_ids[name]}
+        for product_id, names in categories_by_product.items()
+        for name in {name[:100] for name in names}
+    ]
+    if links:
+        db.session.execute(insert(product_categories), links)
+
+def _category_price_deltas(products):
+    """Group (categories, price) pairs into VALUES rows of (name, count, total, min price, max price) per category."""
+    deltas = {}
+    for categories, price in products:
+        price = float(price)
+        for name in {name[:100] for name in categories or []}:
+            count, total, low, high = deltas.get(name, (0, 0.0, price, price))
+            deltas[name] = (count + 1, total + price, min(low, price), max(high, price))
+
+    if not deltas:
+        return None
+    return values(
+        column("name", db.String), column("count", db.Integer), column("total", db.Float),
+        column("min_price", db.Float), column("max_price", db.Float),
+        name="deltas"
+    ).data([(name, *delta) for name, delta in deltas.items()])
+
+def _add_category_stats(user_id, products):
+    """
+    Count products into the user's per-category aggregates. Doesn't commit.
+
+    Parameters:
+        user_id (int): ID of the user the products belong to.
+        products (iterable): (category names, price) pairs.
+    """
+    deltas = _category_price_deltas(products)
+    if deltas is None:
+        return
+
+    stmt = pg_insert(UserCategoryStats).from_select(
+        ["user_id", "category_id", "product_count", "price_total", "min_price", "max_price"],
+        select(literal(user_id), Category.id, deltas.c.count, deltas.c.total, deltas.c.min_price, deltas.c.max_price)
+        .join(deltas, deltas.c.name == Category.name)
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id", "category_id"],
+        set_={
+            "product_count": UserCategoryStats.product_count + stmt.excluded.product_count,
+            "price_total": UserCategoryStats.price_total + stmt.excluded.price_total,
+            "min_price": db.func.least(UserCategoryStats.min_price, stmt.excluded.min_price),
+            "max_price": db.func.greatest(UserCategoryStats.max_price, stmt.excluded.max_price),
+        }
+    ))
+
+def _remove_category_stats(user_id, products):
+    """Take deleted or changed products out of the user's per-category aggregates. Doesn't commit.
+
+    Parameters:
+        user_id (int): ID of the user the products belong to.
+        products (iterable): (category names, price) pairs with the products' old values, already flushed."""
+    deltas = _category_price_deltas(products)
+    if deltas is None:
+        return
+
+    def remaining_price(aggregate):
+        return (
+            select(aggregate(Products.price))
+            .join(product_categories, product_categories.c.product_id == Products.id)
+            .where(Products.user_id == UserCategoryStats.user_id, product_categories.c.category_id == UserCategoryStats.category_id)
+            .scalar_subquery()
+        )
+
+    db.session.execute(
+        update(UserCategoryStats)
+        .where(
+            UserCategoryStats.user_id == user_id,
+            UserCategoryStats.category_id == Category.id,
+            Category.name == deltas.c.name
+        )
+        .values(
+            product_count=UserCategoryStats.product_count - deltas.c.count,
+            price_total=UserCategoryStats.price_total - deltas.c.total,
+            min_price=case((deltas.c.min_price <= UserCategoryStats.min_price, remaining_price(db.func.min)), else_=UserCategoryStats.min_price),
+            max_price=case((deltas.c.max_price >= UserCategoryStats.max_price, remaining_price(db.func.max)), else_=UserCategoryStats.max_price)
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(UserCategoryStats)
+        .where(UserCategoryStats.user_id == user_id, UserCategoryStats.product_count <= 0)
+        .execution_options(synchronize_session=False)
+    )
+
+def get_category_facets(user_id):
+    """Return the user's categories with product counts and price ranges, from the maintained aggregates."""
+    return db.session.execute(
+        select(
+            Category.name,
+            UserCategoryStats.product_count,
+            UserCategoryStats.price_total,
+            UserCategoryStats.min_price,
+            UserCategoryStats.max_price
+        )
+        .join(Category, Category.id == UserCategoryStats.category_id)
+        .where(UserCategoryStats.user_id == user_id)
+        .order_by(Category.name)
+    ).all()
+
 def create_product(user_id, url, price, productName, categories, favorited=False):
     """Create a new product for a user."""
     product = Products(
@@ -169,166 +360,563 @@ def create_product(user_id, url, price, productName, categories, favorited=False
         price=price,
         productName=productName,
         category=categories,
+        primary_category=_primary_category(categories),
         favorited=favorited
     )
     db.session.add(product)
+    db.session.flush()
+    _link_product_categories({product.id: categories})
+    _add_category_stats(user_id, [(categories, price)])
     db.session.commit()
+    product_listing_cache.invalidate(user_id)
     return product
 
-def get_products(user_id, sort_by=None, extra_sort_by=None, min_price=None, max_price=None, category_filter=None, limit=10,
-    offset=0):
+def bulk_create_products(user_id, rows):
     """
-    Fetch products based on dynamic filters, sorting, and ranges.
-    
+    Insert a batch of products for a user with a multi-row INSERT in one transaction.
+
     Parameters:
-        user_id (int): ID of the user whose products to fetch.
-        sort_by (str): Field to sort by ('price', 'category').
-        extra_sort_by (str): Sort direction ('ascending', 'descending').
-        min_price (float): Minimum price filter.
-        max_price (float): Maximum price filter.
-        category_filter (str): Filter by category.
+        user_id (int): ID of the user the products belong to.
+        rows (list): Dicts of validated url, price, productName, category and favorited values.
+
+    Returns:
+        The number of products inserted.
     """
-    query = Products.query.filter_by(user_id=user_id)
+    if not rows:
+        return 0
+    try:
+        product_ids = db.session.execute(
+            insert(Products).returning(Products.id, sort_by_parameter_order=True),
+            [dict(row, user_id=user_id, primary_category=_primary_category(row["category"])) for row in rows]
+        ).scalars().all()
+        _link_product_categories({product_id: row["category"] for product_id, row in zip(product_ids, rows)})
+        _add_category_stats(user_id, [(row["category"], row["price"]) for row in rows])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    product_listing_cache.invalidate(user_id)
+    return len(rows)
 
-    if min_price is not None:
-        query = query.filter(Products.price >= min_price)
-    if max_price is not None:
-        query = query.filter(Products.price <= max_price)
+def _product_sort_key(sort_by, extra_sort_by):
+    """Return the (column, descending) pair a product listing is ordered by; None orders by id alone."""
+    if sort_by == 'favorited':
+        return Products.favorited, True
+    if sort_by == 'price':
+        return Products.price, extra_sort_by == 'descending'
+    if sort_by == 'category':
+        return Products.primary_category, extra_sort_by == 'descending'
+    return None, True
 
-    if category_filter:
-        if isinstance(category_filter, str):
-            category_filter = [category_filter]
-        """Below is for retrieving products that match one of the categories selected for filtering"""
-        query = query.filter(
-            or_(
-                *(cast(Products.category, JSONB).contains([cat]) for cat in category_filter)
-            )
-        )
+def _ranks_by_search(sort_by, search):
+    """A search with no explicit sort is ordered by relevance."""
+    return bool(search) and sort_by not in ('favorited', 'price', 'category')
 
-    if sort_by == 'favorited':
-        query = query.order_by(desc(Products.favorited), desc(Products.id))
-    elif sort_by == 'price':
-        query = query.order_by(desc(Products.price) if extra_sort_by == 'descending' else asc(Products.price))
-    elif sort_by == 'category':
-        query = query.order_by(desc(Products.category) if extra_sort_by == 'descending' else asc(Products.category))
-    else:
-        query = query.order_by(desc(Products.id))
+def _search_tsquery(search):
+    """Parse search text (quoted phrases, OR, -exclusions) into a tsquery matching products.search_vector."""
+    return db.func.websearch_to_tsquery('simple', search)
 
-    query = query.limit(limit).offset(offset)
+def encode_product_cursor(product, sort_by=None, extra_sort_by=None, search=None):
+    """Build the opaque cursor pointing just past the given product, or None for relevance-ordered searches."""
+    if _ranks_by_search(sort_by, search):
+        return None
 
-    print("Final query:", query)
+    column, descending = _product_sort_key(sort_by, extra_sort_by)
+    payload = {
+        "sort": column.key if column is not None else "id",
+        "desc": descending,
+        "key": getattr(product, column.key) if column is not None else None,
+        "id": product.id,
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
 
-    return query.all()
+def decode_product_cursor(cursor, sort_by=None, extra_sort_by=None):
+    """Decode a cursor made by encode_product_cursor, raising ValueError if it doesn't fit the ordering."""
+    column, descending = _product_sort_key(sort_by, extra_sort_by)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        sort, cursor_desc, key, last_id = payload["sort"], payload["desc"], payload["key"], int(payload["id"])
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
 
-def get_favorited_products(user_id):
-    """ Returns the favorited products of user"""
-    return Products.query.filter_by(user_id=user_id, favorited=True)
+    if sort != (column.key if column is not None else "id") or cursor_desc != descending:
+        raise ValueError("Cursor does not match the requested sort order")
+    return key, last_id
+
+def _filtered_products_query(user_id, min_price=None, max_price=None, category_filter=None, search=None, columns=LISTING_COLUMNS):
+    """Build a select of `columns` for a user's products matching the price, category and search filters."""
+    query = select(*columns).where(Products.user_id == user_id)
 
-def count_products(user_id, min_price=None, max_price=None, category_filter=None):
-    query = Products.query.filter_by(user_id=user_id)
+    if search:
+        query = query.where(Products.search_vector.op('@@')(_search_tsquery(search)))
 
     if min_price is not None:
-        query = query.filter(Products.price >= min_price)
+        query = query.where(Products.price >= min_price)
     if max_price is not None:
-        query = query.filter(Products.price <= max_price)
+        query = query.where(Products.price <= max_price)
+
     if category_filter:
         if isinstance(category_filter, str):
             category_filter = [category_filter]
         """Below is for retrieving products that match one of the categories selected for filtering"""
-        query = query.filter(
-            or_(
-                *(cast(Products.category, JSONB).contains([cat]) for cat in category_filter)
+        query = query.where(
+            exists().where(
+                product_categories.c.product_id == Products.id,
+                product_categories.c.category_id.in_(select(Category.id).where(Category.name.in_(category_filter)))
             )
         )
 
-    return query.count()
+    return query
+
+def _order_products_query(query, sort_by=None, extra_sort_by=None, cursor=None, search=None):
+    """Apply the listing order to a products query, seeking past `cursor` when one is given."""
+    if _ranks_by_search(sort_by, search):
+        if cursor:
+            raise ValueError("Cursors are not supported for search results ordered by relevance")
+        rank = db.func.ts_rank_cd(Products.search_vector, _search_tsquery(search))
+        return query.order_by(desc(rank), desc(Products.id))
+
+    column, descending = _product_sort_key(sort_by, extra_sort_by)
+    direction = desc if descending else asc
 
-def get_product_by_id(user_id, product_id):
+    if cursor:
+        key, last_id = decode_product_cursor(cursor, sort_by, extra_sort_by)
+        if column is None:
+            position, last_position = Products.id, last_id
+        else:
+            position = tuple_(column, Products.id)
+            last_position = tuple_(literal(key, column.type), last_id)
+        query = query.where(position < last_position if descending else position > last_position)
+
+    if column is not None:
+        return query.order_by(direction(column), direction(Products.id))
+    return query.order_by(direction(Products.id))
+
+def list_products(user_id, sort_by=None, extra_sort_by=None, min_price=None, max_price=None, category_filter=None, limit=10,
+    offset=0, cursor=None, search=None, include_total=True):
     """
-    Fetch a single product by ID for a specific user.
-    
+    Fetch a page of products, as plain rows for Products.serialize_row, and the size of the filtered listing.
+
     Parameters:
-        user_id (int): ID of the user.
-        product_id (int): ID of the product.
-    
+        user_id (int): ID of the user whose products to fetch.
+        sort_by (str): Field to sort by ('price', 'category', 'favorited'); without it, searches sort by relevance.
+        extra_sort_by (str): Sort direction ('ascending', 'descending').
+        min_price (float): Minimum price filter.
+        max_price (float): Maximum price filter.
+        category_filter (str): Filter by category.
+        offset (int): Number of rows before this page.
+        cursor (str): Cursor from encode_product_cursor to seek past instead of skipping `offset` rows.
+        search (str): Full-text search over product name and url.
+        include_total (bool): When False, skip counting and fetch one extra row to find has_next.
+
     Returns:
-        Product object if found, else None.
+        (products, total, has_next) where total is None if include_total is False.
     """
-    return Products.query.filter_by(user_id=user_id, id=product_id).first()
+    query = _filtered_products_query(user_id, min_price, max_price, category_filter, search)
+    query = _order_products_query(query, sort_by, extra_sort_by, cursor, search)
+    page_offset = 0 if cursor else offset
 
-def update_product(product_id, **kwargs):
-    """Update a product's details."""
-    product = Products.query.get(product_id)
-    if not product:
-        return None
-    for key, value in kwargs.items():
-        setattr(product, key, value)
-    db.session.commit()
+    if not include_total:
+        products = db.session.execute(query.limit(limit + 1).offset(page_offset)).all()
+        return products[:limit], None, len(products) > limit
+
+    products = db.session.execute(
+        query.add_columns(db.func.count().over().label("total")).limit(limit).offset(page_offset)
+    ).all()
+
+    if products:
+        # With a cursor the window only sees rows past it, so add back the rows before this page.
+        total = products[0].total + (offset if cursor else 0)
+    elif cursor or offset:
+        # Past the end of the listing the window has no row to report the total on.
+        total = count_products(user_id, min_price, max_price, category_filter, search)
+    else:
+        total = 0
+
+    return products, total, bool(products) and offset + len(products) < total
+
+def iter_product_rows(user_id, batch_size=1000):
+    """Yield all of a user's products as plain rows, oldest first, `batch_size` at a time through a server-side cursor."""
+    stmt = (
+        select(*PRODUCT_COLUMNS)
+        .where(Products.user_id == user_id)
+        .order_by(Products.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = db.session.execute(stmt)
+    try:
+        yield from result
+    finally:
+        result.close()
+
+def get_favorited_products(user_id):
+    """ Returns the favorited products of user as plain rows, newest first"""
+    return db.session.execute(
+        select(*PRODUCT_COLUMNS)
+        .where(Products.user_id == user_id, Products.favorited)
+        .order_by(Products.id.desc())
+    ).all()
+
+def count_products(user_id, min_price=None, max_price=None, category_filter=None, search=None):
+    query = _filtered_products_query(user_id, min_price, max_price, category_filter, search, columns=(db.func.count(),))
+    return db.session.execute(query).scalar()
+
+def update_product(product_id, user_id, **kwargs):
+    """Update the details of one of a user's products.
+
+    Returns:
+        The updated product row, or None if the user has no product with that ID."""
+    changes = dict(kwargs)
+    if changes.get("category") is not None:
+        changes["primary_category"] = _primary_category(changes["category"])
+
+    old = (
+        select(Products.id, Products.category, Products.price)
+        .where(Products.id == product_id, Products.user_id == user_id)
+        .with_for_update()
+        .subquery("old")
+    )
+    try:
+        product = db.session.execute(
+            update(Products)
+            .where(Products.id == old.c.id)
+            .values(**changes)
+            .returning(*PRODUCT_COLUMNS, old.c.category.label("old_category"), old.c.price.label("old_price"))
+            .execution_options(synchronize_session=False)
+        ).first()
+        if product is None:
+            db.session.rollback()
+            return None
+
+        if product.category != product.old_category:
+            _link_product_categories({product.id: product.category}, replace=True)
+        if product.category != product.old_category or product.price != product.old_price:
+            _remove_category_stats(user_id, [(product.old_category, product.old_price)])
+            _add_category_stats(user_id, [(product.category, product.price)])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    product_listing_cache.invalidate(user_id)
     return product
 
-def toggle_favorited(product_id):
-    """Toggle the favorited status of a product."""
-    product = Products.query.get(product_id)
-    if not product:
-        return None
-    product.favorited = not product.favorited
+def toggle_favorited(product_id, user_id):
+    """Toggle the favorited status of one of a user's products.
+
+    Returns:
+        The updated product row, or None if the user has no product with that ID."""
+    product = db.session.execute(
+        update(Products)
+        .where(Products.id == product_id, Products.user_id == user_id)
+        .values(favorited=~Products.favorited)
+        .returning(*PRODUCT_COLUMNS)
+        .execution_options(synchronize_session=False)
+    ).first()
     db.session.commit()
+    if product is not None:
+        product_listing_cache.invalidate(user_id)
     return product
 
-def delete_product(product_id):
-    """Delete a product by ID."""
-    product = Products.query.get(product_id)
-    if product:
-        db.session.delete(product)
+def delete_product(product_id, user_id):
+    """Delete one of a user's products by ID. Returns whether a product was deleted."""
+    try:
+        product = db.session.execute(
+            delete(Products)
+            .where(Products.id == product_id, Products.user_id == user_id)
+            .returning(Products.id, Products.category, Products.price)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if product is not None:
+            _remove_category_stats(user_id, [(product.category, product.price)])
         db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if product is not None:
+        product_listing_cache.invalidate(user_id)
     return product is not None
 
+def batch_delete_products(user_id, product_ids):
+    """Delete the user's products among the given ids, ignoring ids that aren't theirs.
+
+    Returns:
+        The ids of the deleted products."""
+    try:
+        deleted = db.session.execute(
+            delete(Products)
+            .where(Products.user_id == user_id, Products.id.in_(product_ids))
+            .returning(Products.id, Products.category, Products.price)
+            .execution_options(synchronize_session=False)
+        ).all()
+        _remove_category_stats(user_id, [(row.category, row.price) for row in deleted])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    product_listing_cache.invalidate(user_id)
+    return [row.id for row in deleted]
+
+def batch_set_favorited(user_id, product_ids, favorited):
+    """Set the favorited flag on the user's products among the given ids.
+
+    Returns:
+        Rows of the updated products."""
+    try:
+        updated = db.session.execute(
+            update(Products)
+            .where(Products.user_id == user_id, Products.id.in_(product_ids))
+            .values(favorited=favorited)
+            .returning(*PRODUCT_COLUMNS)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    product_listing_cache.invalidate(user_id)
+    return updated
+
+def batch_set_categories(user_id, product_ids, categories):
+    """Replace the categories of the user's products among the given ids.
+
+    Returns:
+        Rows of the updated products."""
+    try:
+        old = (
+            select(Products.id, Products.category, Products.price)
+            .where(Products.user_id == user_id, Products.id.in_(product_ids))
+            .with_for_update()
+            .subquery("old")
+        )
+        updated = db.session.execute(
+            update(Products)
+            .where(Products.id == old.c.id)
+            .values(category=categories, primary_category=_primary_category(categories))
+            .returning(*PRODUCT_COLUMNS, old.c.category.label("old_category"))
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        if updated:
+            _link_product_categories({row.id: categories for row in updated}, replace=True)
+            _remove_category_stats(user_id, [(row.old_category, row.price) for row in updated])
+            _add_category_stats(user_id, [(categories, row.price) for row in updated])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    product_listing_cache.invalidate(user_id)
+    return updated
+
 # -- Friend Operations --
 
+def _friendship_key(user1_id, user2_id):
+    """Return the pair in the order friendships are stored: lower user id first."""
+    return min(user1_id, user2_id), max(user1_id, user2_id)
+
+def _friend_ids_of(user_ids):
+    """Return the ids of everyone who is friends with any of the given users, in one query."""
+    if not user_ids:
+        return set()
+    return set(db.session.execute(
+        select(Friends.user2_id).where(Friends.user1_id.in_(user_ids))
+        .union(select(Friends.user1_id).where(Friends.user2_id.in_(user_ids)))
+    ).scalars())
+
+def _invalidate_friend_suggestions(user1_id, user2_id):
+    """Drop the cached suggestions of two users whose friendship changed and of their friends."""
+    for user_id in {user1_id, user2_id} | _friend_ids_of([user1_id, user2_id]):
+        friend_suggestion_cache.invalidate(user_id)
+
 def create_friendship(user1_id, user2_id):
-    """Create a friendship between two users."""
-    friendship = Friends(user1_id=user1_id, user2_id=user2_id)
-    db.session.add(friendship)
+    """Create a friendship between two users. Returns False if they were already friends."""
+    low_id, high_id = _friendship_key(user1_id, user2_id)
+    created = db.session.execute(
+        pg_insert(Friends)
+        .values(user1_id=low_id, user2_id=high_id)
+        .on_conflict_do_nothing(index_elements=["user1_id", "user2_id"])
+    ).rowcount == 1
     db.session.commit()
-    return friendship
+    friend_id_cache.add_friendship(user1_id, user2_id)
+    _invalidate_friend_suggestions(user1_id, user2_id)
+    return created
+
+def get_friend_ids(user_id):
+    """Return the ids of a user's friends, reading each side of the friendship table through its index."""
+    return db.session.execute(
+        select(Friends.user2_id).where(Friends.user1_id == user_id)
+        .union(select(Friends.user1_id).where(Friends.user2_id == user_id))
+    ).scalars().all()
 
-def get_friends(user_id):
-    """Fetch all friends for a user."""
-    return Friends.query.filter(
-        or_(Friends.user1_id == user_id, Friends.user2_id == user_id)
+def get_friend_list(user_id):
+    """Return a user's friends as (id, username, isOnline) rows ordered by username."""
+    friend_ids = (
+        select(Friends.user2_id.label("friend_id")).where(Friends.user1_id == user_id)
+        .union(select(Friends.user1_id).where(Friends.user2_id == user_id))
+        .subquery()
+    )
+    return db.session.execute(
+        select(User.id, User.username, User.isOnline)
+        .join(friend_ids, User.id == friend_ids.c.friend_id)
+        .order_by(User.username)
     ).all()
 
 def check_friendship(user1_id, user2_id):
-    """Check if a friendship exists between two users."""
-    return Friends.query.filter(
-        or_(
-            and_(Friends.user1_id == user1_id, Friends.user2_id == user2_id),
-            and_(Friends.user1_id == user2_id, Friends.user2_id == user1_id)
+    """Check if a friendship exists between two users, with one lookup on the unique (user1_id, user2_id) index."""
+    low_id, high_id = _friendship_key(user1_id, user2_id)
+    return db.session.execute(
+        select(Friends.id).where(Friends.user1_id == low_id, Friends.user2_id == high_id)
+    ).first() is not None
+
+def delete_friendship(user1_id, user2_id):
+    """Delete a friendship between two users. Returns whether there was one."""
+    low_id, high_id = _friendship_key(user1_id, user2_id)
+    deleted = db.session.execute(
+        delete(Friends)
+        .where(Friends.user1_id == low_id, Friends.user2_id == high_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+    db.session.commit()
+    if deleted:
+        friend_id_cache.remove_friendship(user1_id, user2_id)
+        _invalidate_friend_suggestions(user1_id, user2_id)
+    return deleted
+
+def get_friend_suggestions(user_id, limit=10):
+    """Return friends of the user's friends as (id, username, mutual_friends) rows, most mutual friends first.
+
+    Parameters:
+        user_id (int): The user to suggest friends for; their friends and pending requests are left out.
+        limit (int): How many suggestions to return."""
+    friend_ids = (
+        select(Friends.user2_id.label("friend_id")).where(Friends.user1_id == user_id)
+        .union(select(Friends.user1_id).where(Friends.user2_id == user_id))
+        .cte("friend_ids")
+    )
+    friends_of_friends = (
+        select(Friends.user2_id.label("candidate_id")).join(friend_ids, Friends.user1_id == friend_ids.c.friend_id)
+        .union_all(select(Friends.user1_id).join(friend_ids, Friends.user2_id == friend_ids.c.friend_id))
+        .subquery("friends_of_friends")
+    )
+    mutual_friends = db.func.count().label("mutual_friends")
+
+    candidates = (
+        select(friends_of_friends.c.candidate_id, mutual_friends)
+        .where(
+            friends_of_friends.c.candidate_id != user_id,
+            friends_of_friends.c.candidate_id.not_in(select(friend_ids.c.friend_id)),
+            ~exists().where(
+                FriendRequest.sender_id == user_id,
+                FriendRequest.receiver_id == friends_of_friends.c.candidate_id,
+                FriendRequest.status == "pending"
+            ),
+            ~exists().where(
+                FriendRequest.sender_id == friends_of_friends.c.candidate_id,
+                FriendRequest.receiver_id == user_id,
+                FriendRequest.status == "pending"
+            )
         )
-    ).first()
+        .group_by(friends_of_friends.c.candidate_id)
+        .order_by(mutual_friends.desc(), friends_of_friends.c.candidate_id)
+        .limit(limit)
+        .subquery("candidates")
+    )
+    return db.session.execute(
+        select(User.id, User.username, candidates.c.mutual_friends)
+        .join(candidates, User.id == candidates.c.candidate_id)
+        .order_by(candidates.c.mutual_friends.desc(), User.id)
+    ).all()
 
+def _relationship_state(viewer_id, target_id):
+    """Return a CASE expression naming how the viewer relates to the target: "self", "friend", "sent", "received" or "none"."""
+    def pending(sender_id, receiver_id):
+        return exists().where(
+            FriendRequest.sender_id == sender_id,
+            FriendRequest.receiver_id == receiver_id,
+            FriendRequest.status == "pending"
+        )
 
-def delete_friendship(user1_id, user2_id):
-    """Delete a friendship between two users."""
-    friendship = Friends.query.filter(
-        or_(
-            (Friends.user1_id == user1_id) & (Friends.user2_id == user2_id),
-            (Friends.user1_id == user2_id) & (Friends.user2_id == user1_id)
+    return case(
+        (target_id == viewer_id, "self"),
+        (exists().where(
+            Friends.user1_id == db.func.least(viewer_id, target_id),
+            Friends.user2_id == db.func.greatest(viewer_id, target_id)
+        ), "friend"),
+        (pending(viewer_id, target_id), "sent"),
+        (pending(target_id, viewer_id), "received"),
+        else_="none"
+    )
+
+def get_relationship_state(viewer_id, target_id):
+    """Return "self", "friend", "sent", "received" or "none" for the viewer and target user, in one query."""
+    return db.session.execute(
+        select(_relationship_state(literal(viewer_id, db.Integer), literal(target_id, db.Integer)))
+    ).scalar()
+
+def get_profile(viewer_id, username):
+    """Fetch a user's profile, relationship to the viewer and favorited products in one query.
+
+    Returns:
+        An object with id, username, description, relationship and favorites, or None if there is no such user."""
+    target = (
+        select(User.id, User.username, User.description)
+        .where(User.username == username)
+        .order_by(User.id)
+        .limit(1)
+        .cte("target")
+    )
+    favorites = (
+        select(*PRODUCT_COLUMNS)
+        .where(Products.user_id == select(target.c.id).scalar_subquery(), Products.favorited)
+        .subquery("favorites")
+    )
+    favorites_json = select(
+        db.func.coalesce(
+            db.func.json_agg(aggregate_order_by(favorites.table_valued(), favorites.c.id.desc())),
+            literal_column("'[]'::json")
+        )
+    ).scalar_subquery()
+
+    profile = db.session.execute(
+        select(
+            target.c.id,
+            target.c.username,
+            target.c.description,
+            _relationship_state(literal(viewer_id, db.Integer), target.c.id).label("relationship"),
+            favorites_json.label("favorites")
         )
     ).first()
-    if friendship:
-        db.session.delete(friendship)
-        db.session.commit()
-    return friendship is not None
+    if profile is None:
+        return None
+
+    return SimpleNamespace(
+        id=profile.id,
+        username=profile.username,
+        description=profile.description,
+        relationship=profile.relationship,
+        favorites=[SimpleNamespace(**product) for product in profile.favorites]
+    )
 
 # -- Friend Request Operations --
 
+def _adjust_pending_request_count(user_id, change):
+    """Add change to the user's pending request counter, without committing, and return the new count."""
+    return db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(pending_request_count=db.func.greatest(User.pending_request_count + change, 0))
+        .returning(User.pending_request_count)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
 def create_friend_request(sender_id, receiver_id):
-    """Create a friend request."""
+    """Create a friend request and count it against the receiver. Returns the receiver's new pending count."""
     friend_request = FriendRequest(sender_id=sender_id, receiver_id=receiver_id)
     db.session.add(friend_request)
+    pending_count = _adjust_pending_request_count(receiver_id, 1)
     db.session.commit()
-    return
+    friend_suggestion_cache.invalidate(sender_id)
+    friend_suggestion_cache.invalidate(receiver_id)
+    return pending_count
 
 def get_friend_requests(receiver_id=None, sender_id=None, status=None):
     """Fetch friend requests dynamically based on filters."""
@@ -341,40 +929,120 @@ def get_friend_requests(receiver_id=None, sender_id=None, status=None):
         query = query.filter_by(status=status)
     return query.all()
 
-def update_friend_request(request_id, status):
-    """Update the status of a friend request."""
-    friend_request = FriendRequest.query.get(request_id)
+def get_pending_requesters(receiver_id):
+    """Return the usernames of everyone with a pending friend request to the user, oldest request first, in one query."""
+    return db.session.execute(
+        select(User.username)
+        .join(FriendRequest, FriendRequest.sender_id == User.id)
+        .where(FriendRequest.receiver_id == receiver_id, FriendRequest.status == "pending")
+        .order_by(FriendRequest.id)
+    ).scalars().all()
+
+def update_friend_request(request_id, status, receiver_id=None):
+    """Update the status of a friend request.
+
+    Parameters:
+        receiver_id (int): When given, only a request sent to this user is updated.
+
+    Returns:
+        The updated request row, or None if no request matched."""
+    # The row is locked and its old status read in the same statement, so the receiver's counter moves only on a real change
+    previous = select(FriendRequest.id, FriendRequest.status.label("previous_status")).where(FriendRequest.id == request_id)
+    if receiver_id:
+        previous = previous.where(FriendRequest.receiver_id == receiver_id)
+    previous = previous.with_for_update().subquery()
+
+    friend_request = db.session.execute(
+        update(FriendRequest)
+        .where(FriendRequest.id == previous.c.id)
+        .values(status=status)
+        .returning(FriendRequest.id, FriendRequest.sender_id, FriendRequest.receiver_id, FriendRequest.status, previous.c.previous_status)
+        .execution_options(synchronize_session=False)
+    ).first()
+
     if friend_request:
-        friend_request.status = status
-        db.session.commit()
+        was_pending, is_pending = friend_request.previous_status == "pending", friend_request.status == "pending"
+        if was_pending != is_pending:
+            _adjust_pending_request_count(friend_request.receiver_id, 1 if is_pending else -1)
+    db.session.commit()
+    if friend_request:
+        friend_suggestion_cache.invalidate(friend_request.sender_id)
+        friend_suggestion_cache.invalidate(friend_request.receiver_id)
     return friend_request
 
 def delete_friend_request(request_id):
-    """Delete a friend request."""
-    friend_request = FriendRequest.query.get(request_id)
+    """Delete a friend request, taking it off the receiver's counter if it was pending."""
+    friend_request = db.session.execute(
+        delete(FriendRequest)
+        .where(FriendRequest.id == request_id)
+        .returning(FriendRequest.sender_id, FriendRequest.receiver_id, FriendRequest.status)
+        .execution_options(synchronize_session=False)
+    ).first()
     if friend_request:
-        db.session.delete(friend_request)
+        if friend_request.status == "pending":
+            _adjust_pending_request_count(friend_request.receiver_id, -1)
         db.session.commit()
+        friend_suggestion_cache.invalidate(friend_request.sender_id)
+        friend_suggestion_cache.invalidate(friend_request.receiver_id)
     return friend_request is not None
 
 # -- Community Message Operations --
 
+def bump_community_message_version():
+    """Count a change to community messages in the current transaction and return the new version."""
+    # The row lock orders versions by commit, which write-behind message ids don't.
+    stmt = pg_insert(CommunityMessageVersion).values(id=1, version=1)
+    return db.session.execute(
+        stmt.on_conflict_do_update(index_elements=["id"], set_={"version": CommunityMessageVersion.version + 1})
+        .returning(CommunityMessageVersion.version)
+    ).scalar()
+
+def get_community_message_version():
+    """Return the number of committed changes to community messages, with a primary key lookup."""
+    return db.session.execute(select(CommunityMessageVersion.version).where(CommunityMessageVersion.id == 1)).scalar() or 0
+
 def create_community_message(user_id, content):
-    """Create a new community message."""
+    """Create a new community message. Returns the message and the community message version it committed."""
     message = CommunityMessage(user_id=user_id, content=content)
     db.session.add(message)
+    version = bump_community_message_version()
     db.session.commit()
-    return message
+    return message, version
 
-def get_community_messages():
-    """
-    Fetch the latest community messages up to the specified limit,
-    in descending order (newest first).
-    """
-    return (
-        CommunityMessage.query
-        .options(joinedload(CommunityMessage.user))
-        .order_by(CommunityMessage.timestamp.desc())
-        .limit(30)
-        .all()
-    )
\ No newline at end of file
+def get_community_messages(before_id=None, after_id=None, limit=30):
+    """Fetch the latest community messages up to the specified limit, newest first.
+
+    Parameters:
+        before_id (int): Only return messages older than this one, for scrolling back.
+        after_id (int): Only return messages newer than this one, for catching up after a reconnect.
+
+    Returns:
+        Rows of id, username (None for deleted users), content and timestamp."""
+    position = tuple_(CommunityMessage.timestamp, CommunityMessage.id)
+    query = (
+        select(CommunityMessage.id, User.username, CommunityMessage.content, CommunityMessage.timestamp)
+        .outerjoin(User, User.id == CommunityMessage.user_id)
+    )
+
+    def anchor(message_id):
+        anchor_message = aliased(CommunityMessage)
+        timestamp = select(anchor_message.timestamp).where(anchor_message.id == message_id).scalar_subquery()
+        return tuple_(timestamp, message_id)
+
+    if after_id:
+        messages = db.session.execute(
+            query
+            .where(position > anchor(after_id))
+            .order_by(CommunityMessage.timestamp.asc(), CommunityMessage.id.asc())
+            .limit(limit)
+        ).all()
+        return messages[::-1]
+
+    if before_id:
+        query = query.where(position < anchor(before_id))
+
+    return db.session.execute(
+        query
+        .order_by(CommunityMessage.timestamp.desc(), CommunityMessage.id.desc())
+        .limit(limit)
+    ).all()
\ No newline at end of file
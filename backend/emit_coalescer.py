@@ -0,0 +1,117 @@
+"""Batching of high-rate Socket.IO broadcasts."""
+
+import threading
+import time
+
+BATCH_SUFFIX = "_batch"
+
+
+class EmitCoalescer:
+    """
+    Sends broadcasts of the same event to the same room as one frame per tick.
+
+    While an event is quiet it is emitted straight away, so a lone chat message or
+    status change isn't delayed. Once a second one arrives within a tick of the last
+    send, events are queued and a background task sends each queue every `tick`
+    seconds. A queue holding one payload goes out as the plain event. A longer queue
+    goes out as `<event>_batch` with the payloads in order. A queue is also sent
+    early when it reaches `max_batch`.
+
+    Until start() is called, or when the tick is 0, every emit goes straight through.
+    """
+
+    def __init__(self, socketio, tick=0.05, max_batch=200):
+        self.socketio = socketio
+        self.tick = tick
+        self.max_batch = max_batch
+        self._queues = {}
+        self._last_sent = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self.frames_sent = 0
+        self.events_coalesced = 0
+
+    def init_app(self, app):
+        self.tick = app.config.get("SOCKET_COALESCE_TICK", self.tick)
+        self.max_batch = app.config.get("SOCKET_COALESCE_MAX_BATCH", self.max_batch)
+
+    @property
+    def enabled(self):
+        return self._running and self.tick > 0
+
+    def start(self):
+        """Start the background task that sends queued batches."""
+        if self.tick <= 0 or self._running:
+            return
+        self._running = True
+        self.socketio.start_background_task(self._run)
+
+    def stop(self):
+        self._running = False
+        self.flush()
+
+    def emit(self, event, payload, to=None):
+        """Broadcast payload as event to the room `to`, a list of rooms, or everyone when to is None."""
+        if not self.enabled:
+            self._send(event, payload, to)
+            return
+
+        if isinstance(to, (list, tuple)):
+            # Queue per room, so each room's frame carries every event headed for it.
+            for room in to:
+                self.emit(event, payload, to=room)
+            return
+
+        key = (event, to)
+        now = time.monotonic()
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue and now - self._last_sent.get(key, 0) >= self.tick:
+                self._last_sent[key] = now
+                send_now = [payload]
+            else:
+                self._queues.setdefault(key, []).append(payload)
+                send_now = None
+                if len(self._queues[key]) >= self.max_batch:
+                    send_now = self._queues.pop(key)
+                    self._last_sent[key] = now
+
+        if send_now:
+            self._send_batch(event, send_now, to)
+
+    def flush(self):
+        """Send every queued batch now."""
+        now = time.monotonic()
+        with self._lock:
+            queues, self._queues = self._queues, {}
+            for key in queues:
+                self._last_sent[key] = now
+            # Keys that have been quiet for a tick don't need remembering.
+            self._last_sent = {key: sent for key, sent in self._last_sent.items() if now - sent < self.tick}
+
+        for (event, to), payloads in queues.items():
+            self._send_batch(event, payloads, to)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "framesSent": self.frames_sent,
+                "eventsCoalesced": self.events_coalesced,
+                "queuedEvents": sum(len(queue) for queue in self._queues.values()),
+            }
+
+    def _run(self):
+        while self._running:
+            self.socketio.sleep(self.tick)
+            self.flush()
+
+    def _send_batch(self, event, payloads, to):
+        if len(payloads) == 1:
+            self._send(event, payloads[0], to)
+        else:
+            self.events_coalesced += len(payloads) - 1
+            self._send(event + BATCH_SUFFIX, payloads, to)
+
+    def _send(self, event, payload, to):
+        self.frames_sent += 1
+        self.socketio.emit(event, payload, to=to)
@@ -3,9 +3,26 @@ from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_mailman import Mail
+from listing_cache import ListingCache
+from message_buffer import RecentMessageBuffer
+from message_writer import MessageWriteBehind
+from emit_coalescer import EmitCoalescer
+from friend_cache import FriendIdCache
+from presence import PresenceRegistry
+from connections import ConnectionRegistry
+import os
 
 csrf = CSRFProtect()
-socketio = SocketIO(cors_allowed_origins="http://localhost:3000", ping_timeout=30000, ping_interval=25000)
-# socketio = SocketIO(cors_allowed_origins="*", ping_timeout=30000, ping_interval=25000)
+# Seconds: a ping every 25s, and a connection that misses its pong for 20s is closed
+socketio = SocketIO(cors_allowed_origins="http://localhost:3000", ping_timeout=20, ping_interval=25)
+# socketio = SocketIO(cors_allowed_origins="*", ping_timeout=20, ping_interval=25)
+broadcaster = EmitCoalescer(socketio, tick=0.05, max_batch=200)
 limiter = Limiter(get_remote_address, default_limits=["2000 per day", "500 per hour"])
-mail = Mail()
\ No newline at end of file
+mail = Mail()
+product_listing_cache = ListingCache(max_entries=2000, ttl=60)
+community_message_buffer = RecentMessageBuffer(size=30, mode=os.getenv("COMMUNITY_BUFFER_MODE", "local"))
+message_writer = MessageWriteBehind()
+friend_id_cache = FriendIdCache()
+friend_suggestion_cache = ListingCache(max_entries=5000, ttl=300)
+presence_registry = PresenceRegistry(heartbeat_ttl=90, checkpoint_interval=10)
+connection_registry = ConnectionRegistry(idle_timeout=90, anonymous_timeout=60, reap_interval=30)
@@ -0,0 +1,65 @@
+"""Process-local friend-id sets of online users."""
+
+import threading
+
+
+class FriendIdCache:
+    """
+    Friend ids of each online user, so presence updates can be sent to friends only.
+
+    A user's set is loaded when they go online and dropped when they go offline.
+    create_friendship and delete_friendship update the sets of whichever of the two
+    users are cached. The cache is local to each worker process; a set is reloaded
+    every time its user goes online, which bounds how long another worker's changes
+    go unseen.
+    """
+
+    def __init__(self):
+        self._friends = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id, loader):
+        """Return the user's friend ids, calling loader(user_id) to fetch them if not cached."""
+        with self._lock:
+            if user_id in self._friends:
+                return frozenset(self._friends[user_id])
+
+        friend_ids = set(loader(user_id))
+        with self._lock:
+            self._friends[user_id] = friend_ids
+            return frozenset(friend_ids)
+
+    def reload(self, user_id, loader):
+        """Fetch the user's friend ids again, replacing any cached set."""
+        self.discard(user_id)
+        return self.load(user_id, loader)
+
+    def discard(self, user_id):
+        """Stop tracking a user who went offline."""
+        with self._lock:
+            self._friends.pop(user_id, None)
+
+    def add_friendship(self, user1_id, user2_id):
+        with self._lock:
+            if user1_id in self._friends:
+                self._friends[user1_id].add(user2_id)
+            if user2_id in self._friends:
+                self._friends[user2_id].add(user1_id)
+
+    def remove_friendship(self, user1_id, user2_id):
+        with self._lock:
+            if user1_id in self._friends:
+                self._friends[user1_id].discard(user2_id)
+            if user2_id in self._friends:
+                self._friends[user2_id].discard(user1_id)
+
+    def remove_user(self, user_id):
+        """Forget a deleted user, including as anyone's friend."""
+        with self._lock:
+            self._friends.pop(user_id, None)
+            for friend_ids in self._friends.values():
+                friend_ids.discard(user_id)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._friends)
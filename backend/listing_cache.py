@@ -0,0 +1,107 @@
+"""Process-local cache for per-user query results."""
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class ListingCache:
+    """
+    Bounded LRU cache of per-user results with TTL expiry.
+
+    Entries are stored under the user's current version. invalidate() gives the
+    user a new version, so every cached result for that user stops matching at once
+    and is later pushed out by LRU eviction instead of being searched for and removed.
+
+    Versions come from one counter shared by all users, so no user ever gets the same
+    version twice. A user's version is forgotten once their last invalidation is more
+    than ttl seconds old, and they go back to the default version. Entries expire ttl
+    seconds after the version they were computed under was read, not after they were
+    stored, so anything computed under an older version, however slowly, has expired
+    by then and can't be served again.
+
+    The cache is local to each worker process; the TTL bounds how long another
+    worker's writes can go unseen.
+    """
+
+    def __init__(self, max_entries=2000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # User id -> (version, monotonic time of the invalidation), oldest invalidation first.
+        self._versions = OrderedDict()
+        self._next_version = 1
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def version(self, user_id):
+        """Return a token for the user's current version, to be passed to set() after a query."""
+        with self._lock:
+            return self._current_version(user_id), time.monotonic()
+
+    def get(self, user_id, key):
+        """Return the cached value for the user and key, or None if missing or expired."""
+        with self._lock:
+            entry_key = (user_id, self._current_version(user_id), key)
+            entry = self._entries.get(entry_key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[entry_key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id, key, value, version):
+        """
+        Cache a value computed while the user was at `version`, as returned by version().
+
+        If the user was invalidated in the meantime the value is stored under the
+        old version, where no reader will find it.
+        """
+        version, read_at = version
+        with self._lock:
+            entry_key = (user_id, version, key)
+            self._entries[entry_key] = (read_at + self.ttl, value)
+            self._entries.move_to_end(entry_key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drop every cached result for the user."""
+        now = time.monotonic()
+        with self._lock:
+            self._versions[user_id] = (self._next_version, now)
+            self._versions.move_to_end(user_id)
+            self._next_version += 1
+            self.invalidations += 1
+
+            while self._versions:
+                oldest_user_id, (_, invalidated_at) = next(iter(self._versions.items()))
+                if now - invalidated_at <= self.ttl:
+                    break
+                del self._versions[oldest_user_id]
+
+    def _current_version(self, user_id):
+        version = self._versions.get(user_id)
+        return version[0] if version else 0
+
+    def stats(self):
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "trackedVersions": len(self._versions),
+                "maxEntries": self.max_entries,
+            }
@@ -0,0 +1,83 @@
+"""In-memory buffer of the newest community messages."""
+
+from collections import deque
+import threading
+
+BUFFER_MODES = {"local", "validate", "off"}
+
+
+class RecentMessageBuffer:
+    """
+    Bounded buffer of the newest community messages as serialized dicts, newest first.
+
+    Modes:
+        local: serve reads from memory. Only messages written through this process
+            are seen, so this suits a single worker.
+        validate: before serving, the caller compares the community message version
+            in the database (a primary key lookup) with `version` and reloads on
+            mismatch, so every worker sees messages written by the others. The
+            version moves on every commit, unlike the highest message id, which
+            write-behind ids reserved ahead of time can commit behind.
+        off: don't buffer; every read goes to the database.
+    """
+
+    def __init__(self, size=30, mode="local"):
+        if mode not in BUFFER_MODES:
+            raise ValueError(f"Unknown community buffer mode: {mode}")
+        self.size = size
+        self.mode = mode
+        self._messages = deque(maxlen=size)
+        self._warm = False
+        self._version = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def version(self):
+        """Community message version the contents are known to match, or None if unknown."""
+        with self._lock:
+            return self._version
+
+    def warm(self, messages, version=None):
+        """
+        Replace the buffer contents with messages loaded from the database, newest first.
+
+        Parameters:
+            version (int): Community message version read before the messages were.
+        """
+        with self._lock:
+            self._messages.clear()
+            self._messages.extend(messages[:self.size])
+            self._warm = True
+            self._version = version
+
+    def append(self, message, version=None):
+        """
+        Add a newly created message, pushing out the oldest one when full.
+
+        Parameters:
+            version (int): Version its insert committed, if it has been committed. The buffer
+                only moves to it from the version just before; otherwise another worker's
+                change came in between and the version is left to mismatch.
+        """
+        with self._lock:
+            if self._warm:
+                self._messages.appendleft(message)
+                if version is not None and self._version is not None and version == self._version + 1:
+                    self._version = version
+
+    def snapshot(self):
+        """Return the buffered messages newest first, or None if the buffer needs loading."""
+        with self._lock:
+            if not self._warm or not self.enabled:
+                return None
+            return list(self._messages)
+
+    def invalidate(self):
+        """Drop the contents so the next read reloads from the database."""
+        with self._lock:
+            self._messages.clear()
+            self._warm = False
@@ -0,0 +1,233 @@
+"""Write-behind persistence for community messages."""
+
+from datetime import datetime, timedelta
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from model import CommunityMessage, db
+
+ID_BLOCK_SIZE = 100
+
+
+class MessageWriteBehind:
+    """
+    Persists community messages in the background instead of inside the socket handler.
+
+    submit() gives a message an id from a block reserved from the community_messages
+    sequence and a timestamp, appends it to a local spill file, and returns it to be
+    broadcast straight away. Timestamps follow the database clock, read when each
+    block is reserved and advanced by this process's monotonic clock, so they line
+    up with the now() default of messages inserted directly. A background task inserts queued messages with multi-row
+    INSERTs every COMMUNITY_FLUSH_INTERVAL seconds.
+
+    Each flush closes the current spill segment and deletes it once its messages are
+    committed. Segments still on disk at startup, left by a crash or a failed flush,
+    are replayed. Inserts skip ids that already exist, so replaying is idempotent.
+    Every worker process needs its own COMMUNITY_SPILL_DIR, since startup replays
+    and deletes all segments in it. start() takes a lock on the directory and leaves
+    write-behind off if another process holds it, and submit() refuses messages
+    until the flush task is running, so callers should check `running` first.
+
+    A batch the database rejects, say for a message whose user was deleted before
+    it was flushed, is retried one message at a time. Messages that still fail are
+    logged and appended to dead-letter.ndjson in the spill directory, so they don't
+    hold up the ones queued after them. Only connection and other operational
+    errors requeue the whole batch.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._pending = []
+        self._ids = []
+        self._clock = None
+        self._bump_version = None
+        self._segment = None
+        self._segment_number = 0
+        self._unflushed_segments = []
+        self._lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._running = False
+        self._dir_lock = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, bump_version=None):
+        """
+        Parameters:
+            bump_version (callable): Counts a change to community messages in the current transaction.
+                Each flush calls it before committing, so other workers' buffers see the new messages.
+        """
+        self.app = app
+        self._bump_version = bump_version
+        self.enabled = app.config.get("COMMUNITY_WRITE_BEHIND", False)
+        self.spill_dir = app.config.get("COMMUNITY_SPILL_DIR", "community_spill")
+        self.flush_interval = app.config.get("COMMUNITY_FLUSH_INTERVAL", 0.5)
+        self.batch_size = app.config.get("COMMUNITY_FLUSH_BATCH_SIZE", 500)
+        self.fsync = app.config.get("COMMUNITY_SPILL_FSYNC", True)
+
+    @property
+    def running(self):
+        """Whether messages can be submitted: write-behind is enabled and its flush task has started."""
+        return self.enabled and self._running
+
+    def start(self, socketio):
+        """Replay leftover spill segments and start the background flush task. Needs the database connected."""
+        if not self.enabled or self._running:
+            return
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+        dir_lock = open(os.path.join(self.spill_dir, "writer.lock"), "w")
+        try:
+            fcntl.flock(dir_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            dir_lock.close()
+            logging.error("Another process is using %s; community messages will be written directly", self.spill_dir)
+            return
+        self._dir_lock = dir_lock
+
+        with self.app.app_context():
+            self._replay_segments()
+
+        self._running = True
+        atexit.register(self.shutdown)
+        socketio.start_background_task(self._run, socketio)
+
+    def submit(self, user_id, content):
+        """Queue a message for persistence and return it with its id and timestamp."""
+        if not self.running:
+            raise RuntimeError("Community write-behind is not running; start() it before submitting messages")
+        message_id, timestamp = self._next_id()
+        message = {
+            "id": message_id,
+            "user_id": user_id,
+            "content": content,
+            "timestamp": timestamp,
+        }
+
+        with self._lock:
+            if self._segment is None:
+                self._segment_number += 1
+                self._segment = open(self._segment_path(self._segment_number), "a", encoding="utf-8")
+            self._segment.write(json.dumps(dict(message, timestamp=message["timestamp"].isoformat())) + "\n")
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._pending.append(message)
+
+        return message
+
+    def flush(self):
+        """Insert every queued message. On failure they stay queued, with their segments, for the next flush."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if self._segment is not None:
+                    self._segment.close()
+                    self._unflushed_segments.append(self._segment.name)
+                    self._segment = None
+                segments = list(self._unflushed_segments)
+
+            if not batch and not segments:
+                return
+
+            try:
+                with self.app.app_context():
+                    self._persist(batch)
+            except Exception:
+                logging.exception("Failed to persist %s community messages; will retry", len(batch))
+                with self._lock:
+                    self._pending = batch + self._pending
+                return
+
+            with self._lock:
+                self._unflushed_segments = [name for name in self._unflushed_segments if name not in segments]
+            for name in segments:
+                os.remove(name)
+
+    def shutdown(self):
+        """Stop the background task and persist anything still queued."""
+        self._running = False
+        if self.enabled:
+            self.flush()
+
+    def _run(self, socketio):
+        while self._running:
+            socketio.sleep(self.flush_interval)
+            self.flush()
+
+    def _next_id(self):
+        """Return the next reserved id and the database's current time."""
+        with self._id_lock:
+            if not self._ids:
+                with db.engine.connect() as connection:
+                    rows = connection.execute(
+                        text("SELECT nextval(pg_get_serial_sequence('community_messages', 'id')), localtimestamp FROM generate_series(1, :count)"),
+                        {"count": ID_BLOCK_SIZE}
+                    ).all()
+                self._ids = [row[0] for row in rows]
+                self._clock = (rows[0][1], time.monotonic())
+            database_time, read_at = self._clock
+            return self._ids.pop(0), database_time + timedelta(seconds=time.monotonic() - read_at)
+
+    def _insert(self, messages):
+        for start in range(0, len(messages), self.batch_size):
+            db.session.execute(
+                pg_insert(CommunityMessage)
+                .values(messages[start:start + self.batch_size])
+                .on_conflict_do_nothing(index_elements=["id"])
+            )
+        if self._bump_version is not None:
+            self._bump_version()
+        db.session.commit()
+
+    def _persist(self, messages):
+        """Insert messages, setting aside any the database rejects. Other errors are raised for the caller to retry."""
+        try:
+            self._insert(messages)
+            return
+        except (IntegrityError, DataError):
+            db.session.rollback()
+            logging.warning("Database rejected a batch of %s community messages; retrying them one at a time", len(messages))
+
+        for message in messages:
+            try:
+                self._insert([message])
+            except (IntegrityError, DataError) as e:
+                db.session.rollback()
+                self._dead_letter(message, e)
+
+    def _dead_letter(self, message, error):
+        logging.error("Setting aside community message %s, which the database rejected: %s", message["id"], error.orig)
+        with open(os.path.join(self.spill_dir, "dead-letter.ndjson"), "a", encoding="utf-8") as dead_letters:
+            dead_letters.write(json.dumps(dict(message, timestamp=message["timestamp"].isoformat(), error=str(error.orig))) + "\n")
+
+    def _segment_path(self, number):
+        return os.path.join(self.spill_dir, f"spill-{os.getpid()}-{number:08d}.ndjson")
+
+    def _replay_segments(self):
+        for name in sorted(glob.glob(os.path.join(self.spill_dir, "spill-*.ndjson"))):
+            messages = []
+            with open(name, encoding="utf-8") as segment:
+                for line in segment:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        # Only the last line can be cut short by a crash mid-write.
+                        continue
+                    message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+                    messages.append(message)
+
+            self._persist(messages)
+            os.remove(name)
+            logging.info("Replayed %s community messages from %s", len(messages), name)
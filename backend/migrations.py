@@ -0,0 +1,281 @@
+"""
+    Schema migrations.
+    Run `python migrations.py` to apply any pending migrations to the database in POSTGRES_URI.
+    Applied versions are recorded in the schema_migrations table.
+
+    Each migration is a list of steps, either SQL strings or functions taking a connection.
+    Steps must be safe to re-run, so a migration that was interrupted can simply be applied again,
+    and so seed_database.py can run them over a schema that db.create_all() just built.
+
+    Indexes are built with CREATE INDEX CONCURRENTLY so the tables stay writable while they build.
+    That can't run inside a transaction, so every step runs in autocommit mode.
+"""
+
+from sqlalchemy import text
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def concurrent_index(name, table, definition, unique=False):
+    """Return a step that builds an index without blocking writes to the table."""
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+
+    def step(connection):
+        # A failed concurrent build leaves an INVALID index behind that IF NOT EXISTS would skip over.
+        invalid = connection.execute(text("""
+            SELECT 1 FROM pg_index
+            JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+        """), {"name": name}).first()
+        if invalid:
+            connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+        connection.execute(text(f'CREATE {kind} CONCURRENTLY IF NOT EXISTS "{name}" ON {table} {definition}'))
+
+    return step
+
+
+def validated_constraint(name, table, definition):
+    """
+    Return a step that adds a constraint without blocking writes to the table.
+
+    It's added NOT VALID, which only checks new rows, and then validated, which scans
+    the existing rows under a lock that still allows reads and writes.
+    """
+
+    def step(connection):
+        exists = connection.execute(text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": name}).first()
+        if not exists:
+            connection.execute(text(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition} NOT VALID'))
+        connection.execute(text(f'ALTER TABLE {table} VALIDATE CONSTRAINT "{name}"'))
+
+    return step
+
+
+def backfill_product_categories(connection):
+    """Link existing products to their categories and fill in primary_category, a batch of ids at a time."""
+    connection.execute(text("""
+        INSERT INTO categories (name)
+        SELECT DISTINCT left(jsonb_array_elements_text(category), 100) FROM products
+        ON CONFLICT (name) DO NOTHING
+    """))
+
+    max_id = connection.execute(text("SELECT max(id) FROM products")).scalar() or 0
+    for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+        bounds = {"start": start, "end": start + BACKFILL_BATCH_SIZE}
+        connection.execute(text("""
+            INSERT INTO product_categories (product_id, category_id)
+            SELECT products.id, categories.id
+            FROM products
+            CROSS JOIN LATERAL jsonb_array_elements_text(products.category) AS element(name)
+            JOIN categories ON categories.name = left(element.name, 100)
+            WHERE products.id >= :start AND products.id < :end
+            ON CONFLICT DO NOTHING
+        """), bounds)
+        connection.execute(text("""
+            UPDATE products SET primary_category = lower(left(category ->> 0, 100))
+            WHERE id >= :start AND id < :end AND jsonb_array_length(category) > 0 AND primary_category = ''
+        """), bounds)
+
+
+def batched_by_id(table, *statements):
+    """
+    Return a step that runs statements over a table one range of ids at a time.
+
+    Each statement gets :start and :end bounds, so a large backfill is split into
+    short transactions instead of holding row locks on the whole table.
+    """
+
+    def step(connection):
+        max_id = connection.execute(text(f"SELECT max(id) FROM {table}")).scalar() or 0
+        for start in range(0, max_id + 1, BACKFILL_BATCH_SIZE):
+            bounds = {"start": start, "end": start + BACKFILL_BATCH_SIZE}
+            for statement in statements:
+                connection.execute(text(statement), bounds)
+
+    return step
+
+
+MIGRATIONS = [
+    ("0001_hot_query_indexes", [
+        concurrent_index("ix_products_user_id_id", "products", "(user_id, id)"),
+        concurrent_index("ix_products_user_id_price_id", "products", "(user_id, price, id)"),
+        concurrent_index("ix_products_user_id_favorited_id", "products", "(user_id, favorited, id)"),
+        concurrent_index("ix_products_user_id_category_id", "products", "(user_id, category, id)"),
+        concurrent_index("ix_products_favorited_user_id", "products", "(user_id, id) WHERE favorited"),
+        concurrent_index("ix_products_category", "products", "USING gin (category jsonb_path_ops)"),
+        concurrent_index("ix_community_messages_timestamp", "community_messages", "(timestamp)"),
+        concurrent_index("ix_friend_requests_receiver_id_status", "friend_requests", "(receiver_id, status)"),
+        concurrent_index("ix_friend_requests_sender_id_receiver_id", "friend_requests", "(sender_id, receiver_id)"),
+        concurrent_index("ix_friendship_user1_id_user2_id", "friendship", "(user1_id, user2_id)"),
+        concurrent_index("ix_friendship_user2_id", "friendship", "(user2_id)"),
+    ]),
+    ("0002_normalized_categories", [
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100) NOT NULL UNIQUE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS product_categories (
+            product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE,
+            category_id INTEGER NOT NULL REFERENCES categories (id) ON DELETE CASCADE,
+            PRIMARY KEY (product_id, category_id)
+        )
+        """,
+        # A constant default doesn't rewrite the table.
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS primary_category VARCHAR(100) NOT NULL DEFAULT ''",
+        backfill_product_categories,
+        concurrent_index("ix_product_categories_category_id_product_id", "product_categories", "(category_id, product_id)"),
+        concurrent_index("ix_products_user_id_primary_category_id", "products", "(user_id, primary_category, id)"),
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_products_user_id_category_id",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_products_category",
+    ]),
+    ("0003_user_category_stats", [
+        """
+        CREATE TABLE IF NOT EXISTS user_category_stats (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            category_id INTEGER NOT NULL REFERENCES categories (id) ON DELETE CASCADE,
+            product_count INTEGER NOT NULL DEFAULT 0,
+            price_total DOUBLE PRECISION NOT NULL DEFAULT 0,
+            min_price DOUBLE PRECISION,
+            max_price DOUBLE PRECISION,
+            PRIMARY KEY (user_id, category_id)
+        )
+        """,
+        """
+        INSERT INTO user_category_stats (user_id, category_id, product_count, price_total, min_price, max_price)
+        SELECT products.user_id, product_categories.category_id, count(*), sum(products.price), min(products.price), max(products.price)
+        FROM products
+        JOIN product_categories ON product_categories.product_id = products.id
+        GROUP BY products.user_id, product_categories.category_id
+        ON CONFLICT (user_id, category_id) DO UPDATE SET
+            product_count = EXCLUDED.product_count,
+            price_total = EXCLUDED.price_total,
+            min_price = EXCLUDED.min_price,
+            max_price = EXCLUDED.max_price
+        """,
+    ]),
+    ("0004_product_search", [
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector TSVECTOR",
+        # URL punctuation is turned into spaces so that each part of the address is searchable as a word.
+        """
+        CREATE OR REPLACE FUNCTION products_search_document(product_name TEXT, url TEXT) RETURNS TSVECTOR
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT setweight(to_tsvector('simple', coalesce(product_name, '')), 'A')
+                || setweight(to_tsvector('simple', translate(coalesce(url, ''), '/.-_?=&:#+%', '           ')), 'B')
+        $$
+        """,
+        """
+        CREATE OR REPLACE FUNCTION products_search_vector_update() RETURNS TRIGGER
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.search_vector := products_search_document(NEW."productName", NEW.url);
+            RETURN NEW;
+        END
+        $$
+        """,
+        "DROP TRIGGER IF EXISTS products_search_vector_update ON products",
+        """
+        CREATE TRIGGER products_search_vector_update
+        BEFORE INSERT OR UPDATE OF "productName", url ON products
+        FOR EACH ROW EXECUTE FUNCTION products_search_vector_update()
+        """,
+        batched_by_id(
+            "products",
+            """
+            UPDATE products SET search_vector = products_search_document("productName", url)
+            WHERE id >= :start AND id < :end AND search_vector IS NULL
+            """,
+        ),
+        concurrent_index("ix_products_search_vector", "products", "USING gin (search_vector)"),
+    ]),
+    ("0005_community_message_cursor_index", [
+        concurrent_index("ix_community_messages_timestamp_id", "community_messages", "(timestamp, id)"),
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_community_messages_timestamp",
+    ]),
+    ("0006_canonical_friendships", [
+        # Keep the oldest row of each pair, whichever way round it was stored, and drop self-friendships.
+        """
+        DELETE FROM friendship
+        WHERE user1_id = user2_id OR id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY least(user1_id, user2_id), greatest(user1_id, user2_id) ORDER BY id
+                ) AS position
+                FROM friendship
+            ) ranked
+            WHERE position > 1
+        )
+        """,
+        batched_by_id(
+            "friendship",
+            """
+            UPDATE friendship SET user1_id = user2_id, user2_id = user1_id
+            WHERE id >= :start AND id < :end AND user1_id > user2_id
+            """,
+        ),
+        concurrent_index("ux_friendship_user1_id_user2_id", "friendship", "(user1_id, user2_id)", unique=True),
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_friendship_user1_id_user2_id",
+        validated_constraint("ck_friendship_canonical_order", "friendship", "CHECK (user1_id < user2_id)"),
+    ]),
+    ("0007_pending_request_count", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS pending_request_count INTEGER NOT NULL DEFAULT 0",
+        batched_by_id(
+            "users",
+            """
+            UPDATE users SET pending_request_count = (
+                SELECT count(*) FROM friend_requests
+                WHERE friend_requests.receiver_id = users.id AND friend_requests.status = 'pending'
+            )
+            WHERE id >= :start AND id < :end
+            """,
+        ),
+    ]),
+    ("0008_community_message_version", [
+        """
+        CREATE TABLE IF NOT EXISTS community_message_version (
+            id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+    ]),
+]
+
+
+def upgrade(engine):
+    """Apply every migration that hasn't been recorded in schema_migrations yet."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(100) PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+        # Fail fast rather than queue behind long transactions while holding a lock others wait on.
+        connection.execute(text("SET lock_timeout = '5s'"))
+
+        applied = set(connection.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+        for version, steps in MIGRATIONS:
+            if version in applied:
+                continue
+
+            print(f"Applying migration {version}")
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(text(step))
+
+            connection.execute(text("INSERT INTO schema_migrations (version) VALUES (:version)"), {"version": version})
+
+
+if __name__ == "__main__":
+    import model
+    import server
+
+    model.connect_to_db(server.app, echo=False)
+
+    with server.app.app_context():
+        upgrade(model.db.engine)
@@ -1,7 +1,7 @@
 import os
 from flask_sqlalchemy import SQLAlchemy
 
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 
 import secrets
 
@@ -13,6 +13,13 @@ favorited_products = db.Table(
     db.Column('product_id', db.Integer, db.ForeignKey('products.id'), primary_key=True)
 )
 
+product_categories = db.Table(
+    'product_categories',
+    db.Column('product_id', db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('category_id', db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True),
+    db.Index('ix_product_categories_category_id_product_id', 'category_id', 'product_id')
+)
+
 class User(db.Model):
 
     __tablename__ = "users"
@@ -25,6 +32,8 @@ class User(db.Model):
     products = db.relationship("Products", backref = "user", lazy = True)
     favorited_products = db.relationship("Products", secondary=favorited_products, backref="favorited_by_users")
     isOnline = db.Column(db.Boolean, nullable = False, default=True)
+    # Pending friend requests received, maintained by the friend request crud functions.
+    pending_request_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     reset_code_hash = db.Column(db.String(255), nullable=True)
     reset_code_expiry = db.Column(db.DateTime, nullable=True)
@@ -40,19 +49,55 @@ class Products(db.Model):
     productName = db.Column(db.String(255))
     category = db.Column(JSONB, nullable=False, default=list)
     favorited = db.Column(db.Boolean , nullable = False, default=False)
+    # Lowercased first category, which listings sort by; the categories themselves are linked through product_categories.
+    primary_category = db.Column(db.String(100), nullable=False, default="", server_default="")
+    # Filled in from productName and url by a database trigger (see migrations.py); deferred since only searches use it.
+    search_vector = db.deferred(db.Column(TSVECTOR, nullable=True))
+
+    # Kept in step with migrations.py, which builds these on existing databases.
+    __table_args__ = (
+        db.Index("ix_products_user_id_id", "user_id", "id"),
+        db.Index("ix_products_user_id_price_id", "user_id", "price", "id"),
+        db.Index("ix_products_user_id_favorited_id", "user_id", "favorited", "id"),
+        db.Index("ix_products_user_id_primary_category_id", "user_id", "primary_category", "id"),
+        db.Index("ix_products_favorited_user_id", "user_id", "id", postgresql_where=db.text("favorited")),
+        db.Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     def to_dict(self):
         """Convert Video object to dictionary."""
         
+        return Products.serialize_row(self)
+
+    @staticmethod
+    def serialize_row(row):
+        """Convert a product, or any row with the same column names, to its API dictionary."""
         return {
-            "productId": self.id,
-            "url": self.url,
-            "price": self.price,
-            "productName": self.productName,
-            "category": self.category,
-            "favorited": self.favorited
+            "productId": row.id,
+            "url": row.url,
+            "price": row.price,
+            "productName": row.productName,
+            "category": row.category,
+            "favorited": row.favorited
         }
     
+class Category(db.Model):
+    __tablename__ = "categories"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+
+class UserCategoryStats(db.Model):
+    """Per-user count and price aggregates of each category, maintained by the product crud functions."""
+    __tablename__ = "user_category_stats"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey("categories.id", ondelete="CASCADE"), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    price_total = db.Column(db.Float, nullable=False, default=0)
+    min_price = db.Column(db.Float, nullable=True)
+    max_price = db.Column(db.Float, nullable=True)
+
 class CommunityMessage(db.Model):
     __tablename__ = "community_messages"
 
@@ -63,6 +108,17 @@ class CommunityMessage(db.Model):
 
     user = db.relationship("User", backref="community_messages")
 
+    __table_args__ = (
+        db.Index("ix_community_messages_timestamp_id", "timestamp", "id"),
+    )
+
+class CommunityMessageVersion(db.Model):
+    """Single row counting committed changes to community messages, bumped in the transaction of each one."""
+    __tablename__ = "community_message_version"
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
 class FriendRequest(db.Model):
     __tablename__ = "friend_requests"
 
@@ -74,12 +130,24 @@ class FriendRequest(db.Model):
 
     sender = db.relationship("User", foreign_keys=[sender_id], backref="sent_requests")
     receiver = db.relationship("User", foreign_keys=[receiver_id], backref="received_requests")
+
+    __table_args__ = (
+        db.Index("ix_friend_requests_receiver_id_status", "receiver_id", "status"),
+        db.Index("ix_friend_requests_sender_id_receiver_id", "sender_id", "receiver_id"),
+    )
     
 class Friends(db.Model):
     __tablename__ = 'friendship'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user1_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     user2_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+
+    # Each friendship is stored once, with the lower user id first.
+    __table_args__ = (
+        db.Index("ux_friendship_user1_id_user2_id", "user1_id", "user2_id", unique=True),
+        db.Index("ix_friendship_user2_id", "user2_id"),
+        db.CheckConstraint("user1_id < user2_id", name="ck_friendship_canonical_order"),
+    )
     
 def connect_to_db(flask_app, echo=True):
     flask_app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["POSTGRES_URI"]
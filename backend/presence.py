@@ -0,0 +1,305 @@
+"""Presence registry: who is online and which sockets they have open."""
+
+import atexit
+import logging
+import threading
+import time
+
+PRESENCE_BACKENDS = {"local", "redis"}
+
+
+class LocalPresenceBackend:
+    """
+    Presence state held in this process's memory.
+
+    Suits a single worker, and stands in for the shared backend in tests.
+    """
+
+    def __init__(self):
+        self._online = {}
+        self._dirty = {}
+        self._sids = {}
+        self._lock = threading.Lock()
+
+    def get_online(self, user_id):
+        with self._lock:
+            return self._online.get(user_id)
+
+    def set_online(self, user_id, online):
+        with self._lock:
+            self._online[user_id] = online
+            self._dirty[user_id] = online
+
+    def prime(self, user_id, online):
+        """Record a status read from the database, unless one was set meanwhile."""
+        with self._lock:
+            self._online.setdefault(user_id, online)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._online.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+            self._sids.pop(user_id, None)
+
+    def drain_dirty(self):
+        """Return and clear the statuses changed since the last checkpoint."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            return dirty
+
+    def restore_dirty(self, statuses):
+        """Put back statuses that failed to save, unless they changed again since."""
+        with self._lock:
+            for user_id, online in statuses.items():
+                self._dirty.setdefault(user_id, online)
+
+    def add_sid(self, user_id, sid, expires_at):
+        with self._lock:
+            self._sids.setdefault(user_id, {})[sid] = expires_at
+
+    def remove_sid(self, user_id, sid):
+        """Drop a socket and return how many the user still has open."""
+        with self._lock:
+            sids = self._sids.get(user_id, {})
+            sids.pop(sid, None)
+            if not sids:
+                self._sids.pop(user_id, None)
+            return len(sids)
+
+    def sids(self, user_id):
+        with self._lock:
+            return list(self._sids.get(user_id, {}))
+
+    def expire(self, now):
+        """Drop and return the (user_id, sid) pairs whose heartbeat ran out before now."""
+        expired = []
+        with self._lock:
+            for user_id, sids in list(self._sids.items()):
+                for sid, expires_at in list(sids.items()):
+                    if expires_at < now:
+                        del sids[sid]
+                        expired.append((user_id, sid))
+                if not sids:
+                    del self._sids[user_id]
+        return expired
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(sids) for sids in self._sids.values())
+
+
+class RedisPresenceBackend:
+    """
+    Presence state shared by every worker through Redis.
+
+    Online flags and unsaved changes are hashes keyed by user id. Each user's open
+    sockets are a set, and one sorted set scores every "user_id:sid" by when its
+    heartbeat runs out, so expired sockets are found with a single range query.
+    """
+
+    ONLINE_KEY = "presence:online"
+    DIRTY_KEY = "presence:dirty"
+    EXPIRY_KEY = "presence:expiry"
+    SIDS_KEY = "presence:sids:{}"
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("PRESENCE_BACKEND=redis requires the redis package") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    def get_online(self, user_id):
+        online = self._redis.hget(self.ONLINE_KEY, user_id)
+        return None if online is None else online == "1"
+
+    def set_online(self, user_id, online):
+        flag = "1" if online else "0"
+        pipe = self._redis.pipeline()
+        pipe.hset(self.ONLINE_KEY, user_id, flag)
+        pipe.hset(self.DIRTY_KEY, user_id, flag)
+        pipe.execute()
+
+    def prime(self, user_id, online):
+        self._redis.hsetnx(self.ONLINE_KEY, user_id, "1" if online else "0")
+
+    def forget(self, user_id):
+        sids_key = self.SIDS_KEY.format(user_id)
+        sids = self._redis.smembers(sids_key)
+        pipe = self._redis.pipeline()
+        pipe.hdel(self.ONLINE_KEY, user_id)
+        pipe.hdel(self.DIRTY_KEY, user_id)
+        pipe.delete(sids_key)
+        if sids:
+            pipe.zrem(self.EXPIRY_KEY, *(f"{user_id}:{sid}" for sid in sids))
+        pipe.execute()
+
+    def drain_dirty(self):
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.hgetall(self.DIRTY_KEY)
+        pipe.delete(self.DIRTY_KEY)
+        dirty, _ = pipe.execute()
+        return {int(user_id): flag == "1" for user_id, flag in dirty.items()}
+
+    def restore_dirty(self, statuses):
+        pipe = self._redis.pipeline()
+        for user_id, online in statuses.items():
+            pipe.hsetnx(self.DIRTY_KEY, user_id, "1" if online else "0")
+        pipe.execute()
+
+    def add_sid(self, user_id, sid, expires_at):
+        pipe = self._redis.pipeline()
+        pipe.sadd(self.SIDS_KEY.format(user_id), sid)
+        pipe.zadd(self.EXPIRY_KEY, {f"{user_id}:{sid}": expires_at})
+        pipe.execute()
+
+    def remove_sid(self, user_id, sid):
+        sids_key = self.SIDS_KEY.format(user_id)
+        pipe = self._redis.pipeline()
+        pipe.srem(sids_key, sid)
+        pipe.zrem(self.EXPIRY_KEY, f"{user_id}:{sid}")
+        pipe.scard(sids_key)
+        return pipe.execute()[-1]
+
+    def sids(self, user_id):
+        return list(self._redis.smembers(self.SIDS_KEY.format(user_id)))
+
+    def expire(self, now):
+        expired = []
+        for member in self._redis.zrangebyscore(self.EXPIRY_KEY, "-inf", now):
+            # Whichever worker removes the entry first owns its cleanup.
+            if not self._redis.zrem(self.EXPIRY_KEY, member):
+                continue
+            user_id, sid = member.split(":", 1)
+            self._redis.srem(self.SIDS_KEY.format(user_id), sid)
+            expired.append((int(user_id), sid))
+        return expired
+
+    def connection_count(self):
+        return self._redis.zcard(self.EXPIRY_KEY)
+
+
+class PresenceRegistry:
+    """
+    Tracks each user's online flag and open sockets outside Postgres.
+
+    Toggling a user online or offline only touches the backend. A background task
+    saves changed flags to users.isOnline in one bulk UPDATE every
+    checkpoint_interval seconds, and again at shutdown. A user the registry hasn't
+    seen yet is read from the database once and then served from memory.
+
+    Sockets stay registered while heartbeats keep arriving within heartbeat_ttl
+    seconds. The same task drops the ones that stop and passes each to on_expired.
+    With a shared backend, that includes sockets left behind by a worker that died.
+    """
+
+    def __init__(self, backend=None, heartbeat_ttl=90, checkpoint_interval=10):
+        self.backend = backend or LocalPresenceBackend()
+        self.heartbeat_ttl = heartbeat_ttl
+        self.checkpoint_interval = checkpoint_interval
+        self._load_status = None
+        self._save_statuses = None
+        self._on_expired = None
+        self._running = False
+
+    def init_app(self, app, load_status, save_statuses):
+        """
+        Parameters:
+            load_status (callable): Takes a user id and returns their saved online flag, or None if they don't exist.
+            save_statuses (callable): Takes a dict of user id to online flag and writes them to the database.
+        """
+        self.app = app
+        backend = app.config.get("PRESENCE_BACKEND", "local")
+        if backend not in PRESENCE_BACKENDS:
+            raise ValueError(f"Unknown presence backend: {backend}")
+        if backend == "redis":
+            self.backend = RedisPresenceBackend(app.config["PRESENCE_REDIS_URL"])
+
+        self.heartbeat_ttl = app.config.get("PRESENCE_HEARTBEAT_TTL", self.heartbeat_ttl)
+        self.checkpoint_interval = app.config.get("PRESENCE_CHECKPOINT_INTERVAL", self.checkpoint_interval)
+        self._load_status = load_status
+        self._save_statuses = save_statuses
+
+    def start(self, socketio, on_expired=None):
+        """
+        Start the background task that expires sockets and checkpoints statuses. Needs the database connected.
+
+        Parameters:
+            on_expired (callable): Called with (user_id, sid), inside an app context, for each socket whose heartbeat ran out.
+        """
+        if self._running:
+            return
+        self._on_expired = on_expired
+        self._running = True
+        atexit.register(self.checkpoint)
+        socketio.start_background_task(self._run, socketio)
+
+    def is_online(self, user_id, default=None):
+        """Return whether the user is online, or default if they can't be found."""
+        online = self.backend.get_online(user_id)
+        if online is not None or self._load_status is None:
+            return default if online is None else online
+
+        saved = self._load_status(user_id)
+        if saved is None:
+            return default
+        self.backend.prime(user_id, bool(saved))
+        return self.backend.get_online(user_id)
+
+    def peek(self, user_id, default=None):
+        """Return the user's status if the registry knows it, without reading the database."""
+        online = self.backend.get_online(user_id)
+        return default if online is None else online
+
+    def set_online(self, user_id, online):
+        self.backend.set_online(user_id, online)
+
+    def forget(self, user_id):
+        """Drop everything known about a deleted user."""
+        self.backend.forget(user_id)
+
+    def heartbeat(self, user_id, sid):
+        """Register a socket, or extend one already registered, for another heartbeat_ttl seconds."""
+        self.backend.add_sid(user_id, sid, time.time() + self.heartbeat_ttl)
+
+    def disconnect(self, user_id, sid):
+        """Unregister a socket and return how many the user still has open."""
+        return self.backend.remove_sid(user_id, sid)
+
+    def sids(self, user_id):
+        return self.backend.sids(user_id)
+
+    def connection_count(self):
+        return self.backend.connection_count()
+
+    def sweep(self):
+        """Unregister sockets whose heartbeat ran out, returning them as (user_id, sid) pairs."""
+        return self.backend.expire(time.time())
+
+    def checkpoint(self):
+        """Write every status changed since the last checkpoint to the database."""
+        statuses = self.backend.drain_dirty()
+        if not statuses or self._save_statuses is None:
+            return
+
+        try:
+            with self.app.app_context():
+                self._save_statuses(statuses)
+        except Exception:
+            logging.exception("Failed to checkpoint %s online statuses; will retry", len(statuses))
+            self.backend.restore_dirty(statuses)
+
+    def _run(self, socketio):
+        while self._running:
+            socketio.sleep(self.checkpoint_interval)
+            try:
+                expired = self.sweep()
+                if expired:
+                    logging.info("Expired %s sockets without a heartbeat", len(expired))
+                if expired and self._on_expired:
+                    with self.app.app_context():
+                        for user_id, sid in expired:
+                            self._on_expired(user_id, sid)
+            except Exception:
+                logging.exception("Failed to expire presence heartbeats")
+            self.checkpoint()
@@ -0,0 +1,146 @@
+"""Reading, validating and writing product import and export files."""
+
+import csv
+import io
+import json
+import math
+from model import Products
+
+IMPORT_FORMATS = {"csv", "ndjson"}
+
+EXPORT_FIELDS = ["productId", "url", "price", "productName", "category", "favorited"]
+
+EXPORT_MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+MIMETYPE_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+TRUE_VALUES = {"true", "1", "yes", "y"}
+FALSE_VALUES = {"false", "0", "no", "n", ""}
+
+
+def format_from_mimetype(mimetype):
+    """Return the import format for a request mimetype, or None if it isn't one we read."""
+    return MIMETYPE_FORMATS.get(mimetype)
+
+
+def read_import_rows(stream, file_format):
+    """
+    Yield (line_number, row) pairs from an uploaded byte stream, one row at a time.
+
+    CSV rows are dicts keyed by the header line. NDJSON rows are left as the raw
+    line so that a malformed line is reported by parse_product_row like any other bad row.
+    """
+    # utf-8-sig drops the byte order mark spreadsheet exports start with, which would otherwise stick to the first header
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    if file_format == "csv":
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text_stream, start=1):
+        if line.strip():
+            yield line_number, line
+
+
+def parse_product_row(row):
+    """
+    Validate one imported row and return the column values for a new product.
+
+    Raises ValueError describing the first problem found.
+    """
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError:
+            raise ValueError("Invalid JSON")
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+
+    url = row.get("url")
+    if not isinstance(url, str) or not url.strip():
+        raise ValueError("url is required")
+    url = url.strip()
+    if len(url) > 500:
+        raise ValueError("url must be at most 500 characters")
+
+    price = row.get("price")
+    if price is None or price == "" or isinstance(price, bool):
+        raise ValueError("price is required")
+    try:
+        price = float(price)
+    except (TypeError, ValueError):
+        raise ValueError("price must be a number")
+    if not math.isfinite(price):
+        raise ValueError("price must be a number")
+
+    product_name = row.get("productName")
+    if product_name is not None:
+        if not isinstance(product_name, str):
+            raise ValueError("productName must be a string")
+        if len(product_name) > 255:
+            raise ValueError("productName must be at most 255 characters")
+
+    category = row.get("category") or []
+    if isinstance(category, str):
+        # CSV cells hold several categories separated by '|'.
+        category = [name.strip() for name in category.split("|") if name.strip()]
+    if not isinstance(category, list) or not all(isinstance(name, str) for name in category):
+        raise ValueError("category must be a list of strings")
+    if any(len(name) > 100 for name in category):
+        raise ValueError("category names must be at most 100 characters")
+
+    favorited = row.get("favorited", False)
+    if isinstance(favorited, str):
+        if favorited.strip().lower() in TRUE_VALUES:
+            favorited = True
+        elif favorited.strip().lower() in FALSE_VALUES:
+            favorited = False
+    if favorited is None:
+        favorited = False
+    if not isinstance(favorited, bool):
+        raise ValueError("favorited must be true or false")
+
+    return {
+        "url": url,
+        "price": price,
+        "productName": product_name,
+        "category": category,
+        "favorited": favorited,
+    }
+
+
+def export_lines(rows, file_format):
+    """
+    Yield an export file chunk by chunk for an iterable of products rows.
+
+    CSV category cells are joined with '|' so that the file can be imported again.
+    """
+    if file_format == "ndjson":
+        for row in rows:
+            yield json.dumps(Products.serialize_row(row)) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+
+    writer.writeheader()
+    for row in rows:
+        record = Products.serialize_row(row)
+        record["category"] = "|".join(record["category"] or [])
+        writer.writerow(record)
+
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify, session, current_app
 from flask_socketio import join_room, disconnect
-from extensions import csrf, socketio, mail
-from token_utils import token_required, create_jwt
+from extensions import csrf, socketio, mail, broadcaster, friend_id_cache, presence_registry, connection_registry
+from token_utils import token_required, ops_only, create_jwt
+from sockets import user_room, user_rooms
 import crud
 import logging
 from flask_mailman.message import Message
@@ -10,6 +11,9 @@ app = current_app
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# How long a user with no sockets left stays online, so a page reload doesn't flicker them offline
+OFFLINE_GRACE_SECONDS = 10
+
 """ User Login/Registration related endpoints """
 @auth_bp.route("/login", methods=["POST"])
 @csrf.exempt
@@ -169,6 +173,49 @@ def request_username():
         logging.exception("Unexpected error in /request-username")
         return jsonify({"error": "An unexpected error occurred while attempting to send username"}), 500
 
+def broadcast_status(user_id, username, is_online):
+    """Send a user's status to their friends, and to their own room to keep their other tabs in step."""
+    friend_ids = friend_id_cache.load(user_id, crud.get_friend_ids)
+    broadcaster.emit('status_update', {
+        "username": username,
+        "isOnline": is_online
+    }, to=user_rooms(user_id, *friend_ids))
+
+def go_offline(user_id, username):
+    presence_registry.set_online(user_id, False)
+    broadcast_status(user_id, username, False)
+    friend_id_cache.discard(user_id)
+    logging.info(f"User {username} is now offline")
+
+def release_socket(user_id, username, sid):
+    """
+    Unregister a closed socket. If it was the user's last one, they go offline unless
+    a new socket arrives within OFFLINE_GRACE_SECONDS.
+    """
+    if presence_registry.disconnect(user_id, sid) == 0:
+        socketio.start_background_task(go_offline_after_grace, current_app._get_current_object(), user_id, username)
+
+def go_offline_after_grace(app, user_id, username):
+    socketio.sleep(OFFLINE_GRACE_SECONDS)
+    with app.app_context():
+        if presence_registry.sids(user_id) or not presence_registry.is_online(user_id):
+            return
+        if username is None:
+            user = crud.get_user(id=user_id)
+            if not user:
+                return
+            username = user.username
+        go_offline(user_id, username)
+
+def release_expired_socket(user_id, sid):
+    """Handle a socket whose presence heartbeat ran out."""
+    if sid in connection_registry:
+        # Still connected here but silent; the disconnect handler releases it.
+        socketio.server.disconnect(sid, namespace="/")
+    else:
+        # Left behind by another worker, which may no longer be running.
+        release_socket(user_id, None, sid)
+
 @socketio.on("go-online")
 @token_required
 def handle_go_online(*args, **kwargs):
@@ -182,35 +229,30 @@ def handle_go_online(*args, **kwargs):
             return
         
         user_id = user["user_id"]
-        toggled_user = crud.set_user_online_status(user_id, True)
-        if toggled_user:
-            logging.info(f"User {toggled_user.username} (ID: {user_id})  is now online")
-            
-            user["isOnline"] = True
-            socketio.emit('status_update', {
-                "username": toggled_user.username,
-                "isOnline": True
-            })
-        else:
-            logging.error(f"Failed to toggle online status for user ID {user_id}")
-            disconnect()
+        join_room(user_room(user_id))
+        connection_registry.touched(request.sid, user)
+        presence_registry.set_online(user_id, True)
+        presence_registry.heartbeat(user_id, request.sid)
+        logging.info(f"User {user['username']} (ID: {user_id})  is now online")
+
+        user["isOnline"] = True
+        friend_id_cache.reload(user_id, crud.get_friend_ids)
+        broadcast_status(user_id, user["username"], True)
 
     except Exception as e:
         logging.exception("Unexpected error in connecting socketio")
         disconnect()
 
 @socketio.on('disconnect')
-@token_required
 def handle_disconnect(*args, **kwargs):
+    # The connection registry knows whose socket this was, so the token isn't needed; it may have expired by now.
     try:
-        user = kwargs.get('user')
-        if not user:
-            logging.warning("No user provided to handle_disconnect")
-            disconnect()
+        connection = connection_registry.closed(request.sid)
+        if not connection or connection["user_id"] is None:
             return
+        release_socket(connection["user_id"], connection["username"], request.sid)
     except Exception as e:
         logging.exception("Unexpected error in disconnecting socketio")
-        return jsonify({"error": "An unexpected error occurred while disconnecting from socketio"}), 500
     
 @socketio.on('manual-disconnect')
 @token_required
@@ -231,22 +273,26 @@ def handle_manual_disconnect(*args, **kwargs):
                 cb(False)
             return
         
-        user_id = user["user_id"]
-        toggled_user = crud.set_user_online_status(user_id, False)
-        if toggled_user:
-            logging.info(f"User {toggled_user.username} is now offline")
-            user["isOnline"] = False
-            socketio.emit('status_update', {
-                "username": toggled_user.username,
-                "isOnline": False
-            })
-            if cb:
-                cb(True)
+        user["isOnline"] = False
+        go_offline(user["user_id"], user["username"])
+        if cb:
+            cb(True)
 
     except Exception as e:
         logging.exception("Unexpected error in disconnecting socketio")
         if cb:
             cb(False)
+
+@auth_bp.route('/connection-stats', methods=['GET'])
+@token_required
+@ops_only
+def connection_stats():
+    """Report this worker's socket connections, their estimated memory, and broadcast batching."""
+    return jsonify({
+        **connection_registry.stats(),
+        "presenceSockets": presence_registry.connection_count(),
+        "broadcasts": broadcaster.stats(),
+    })
     
 @auth_bp.route('/sync-status', methods=['GET'])
 @token_required
@@ -258,22 +304,10 @@ def sync_online_status():
             logging.warning("Unauthorized access to /sync-status")
             return jsonify({"error": "Unauthorized"}), 401
 
-        username = user.get("username")
-        toggled_user = crud.get_user(username=username)
-
-        if toggled_user:
-            logging.info(f"User {username} sync status: {toggled_user.isOnline}")
-
-            new_token = create_jwt(toggled_user, app)
-
-            response = jsonify({"isOnline": toggled_user.isOnline})
-            response.set_cookie('jwtToken', new_token, httponly=True, samesite='Lax', secure=False)
-            
-            logging.debug(f"Updated jwtToken with isOnline status: {toggled_user.isOnline}")
-            return response, 200
-        else:
-            logging.warning(f"User not found: {username}")
-            return jsonify({"error": "User not found"}), 404
+        # token_required already read the current status from the presence registry,
+        # so the token doesn't need reissuing to carry it.
+        logging.info(f"User {user['username']} sync status: {user['isOnline']}")
+        return jsonify({"isOnline": user["isOnline"]}), 200
 
     except Exception as e:
         logging.exception("Error syncing online status")
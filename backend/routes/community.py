@@ -1,11 +1,69 @@
 from flask import Blueprint, request, jsonify
-from extensions import csrf, limiter, socketio
+from flask_socketio import emit
+from extensions import csrf, limiter, socketio, community_message_buffer, message_writer, broadcaster
 from token_utils import token_required
 import crud
 import logging
 
 community_bp = Blueprint('community', __name__, url_prefix='/community')
 
+MAX_HISTORY_LIMIT = 100
+
+def serialize_message(message_id, username, content, timestamp):
+    return {
+        'id': message_id,
+        'username': username or "Deleted User",
+        'content': content,
+        'timestamp': timestamp.isoformat()
+    }
+
+def load_recent_messages():
+    """Load the newest community messages from the database into the buffer and return them."""
+    # Read first, so a change committed while loading leaves the buffer behind and reloads it, rather than hidden
+    version = crud.get_community_message_version()
+    messages = [
+        serialize_message(message.id, message.username, message.content, message.timestamp)
+        for message in crud.get_community_messages()
+    ]
+    community_message_buffer.warm(messages, version)
+    return messages
+
+def get_recent_messages():
+    """Return the newest community messages, from the buffer when it can serve them."""
+    if not community_message_buffer.enabled:
+        return load_recent_messages()
+
+    if community_message_buffer.mode == "validate" and crud.get_community_message_version() != community_message_buffer.version:
+        return load_recent_messages()
+
+    messages = community_message_buffer.snapshot()
+    if messages is None:
+        return load_recent_messages()
+    return messages
+
+def get_message_history(before_id=None, after_id=None, limit=30):
+    """
+    Return community messages newest first, older than before_id or newer than after_id.
+
+    A reconnecting client's after_id is usually still in the buffer, in which case
+    the messages it missed are served from memory.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_LIMIT))
+
+    if after_id and not before_id and community_message_buffer.enabled:
+        recent = get_recent_messages()
+        recent_ids = [message['id'] for message in recent]
+        if after_id in recent_ids:
+            return recent[:recent_ids.index(after_id)][-limit:]
+
+    if not before_id and not after_id and limit == community_message_buffer.size:
+        return get_recent_messages()
+
+    return [
+        serialize_message(message.id, message.username, message.content, message.timestamp)
+        for message in crud.get_community_messages(before_id=before_id, after_id=after_id, limit=limit)
+    ]
+
 """ Community Endpoints """
 @community_bp.route('/messages', methods=['GET'])
 @csrf.exempt
@@ -22,17 +80,15 @@ def get_public_messages():
             logging.warning("User tried accessing community messages while offline")
             return jsonify({'error': 'You are offline. Community features are not available.'}), 403
         
-        messages = crud.get_community_messages()
+        before_id = request.args.get('before', default=None, type=int)
+        after_id = request.args.get('after', default=None, type=int)
+        limit = request.args.get('limit', default=community_message_buffer.size, type=int)
+        if before_id and after_id:
+            return jsonify({'error': 'Use either before or after, not both.'}), 400
+
+        messages = get_message_history(before_id, after_id, limit)
         logging.info(f"Fetched {len(messages)} community messages")
-        return jsonify([
-            {
-                'id': message.id,
-                'username': message.user.username if message.user else "Deleted User",
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat()
-            }
-            for message in messages
-        ])
+        return jsonify(messages)
 
     except Exception as e:
         logging.exception("Unexpected error in retrieving community messages")
@@ -48,21 +104,61 @@ def handle_message(*args, **kwargs):
             socketio.emit('message_response', {'success': False, 'error': 'User not authenticated'})
             return
 
-        message_content = args[0].get('message')
+        data = args[0] if args else None
+        message_content = data.get('message') if isinstance(data, dict) else None
+        if not isinstance(message_content, str) or not message_content.strip():
+            logging.warning(f"User {user['username']} sent an empty community message.")
+            socketio.emit('message_response', {'success': False, 'error': 'Message cannot be empty'}, to=request.sid)
+            return
 
         logging.info(f"Message received from {user['username']}: {message_content}")
 
-        message = crud.create_community_message(user['user_id'], message_content)
-        logging.info(f"Created new message with ID {message.id}")
+        if message_writer.running:
+            # Broadcast now; the background writer inserts it with the next batch
+            message = message_writer.submit(user['user_id'], message_content)
+            # Not committed yet; the flush moves the database version on and validating buffers reload then
+            version = None
+            logging.info(f"Queued new message with ID {message['id']}")
+            serialized = serialize_message(message['id'], user['username'], message['content'], message['timestamp'])
+        else:
+            message, version = crud.create_community_message(user['user_id'], message_content)
+            logging.info(f"Created new message with ID {message.id}")
+            serialized = serialize_message(message.id, user['username'], message.content, message.timestamp)
 
-        socketio.emit('message_response', {
-            'success': True,
-            'id': message.id,
-            'username': user['username'],
-            'content': message.content,
-            'timestamp': message.timestamp.isoformat()
-            })
+        community_message_buffer.append(serialized, version)
+
+        broadcaster.emit('message_response', {'success': True, **serialized})
 
     except Exception as e:
         logging.exception("Unexpected error in adding new message")
-        return jsonify({"error": "An unexpected error occurred in adding new message"}), 500
\ No newline at end of file
+        return jsonify({"error": "An unexpected error occurred in adding new message"}), 500
+
+@socketio.on('message-history')
+@token_required
+def handle_message_history(*args, **kwargs):
+    """Reply to the requesting socket only with messages before or after a message id."""
+    try:
+        user = kwargs.get('user')
+        if not user:
+            emit('message-history', {'success': False, 'error': 'User not authenticated'})
+            return
+
+        data = args[0] if args and isinstance(args[0], dict) else {}
+        before_id = data.get('before')
+        after_id = data.get('after')
+        limit = data.get('limit') or community_message_buffer.size
+        if (not all(value is None or isinstance(value, int) for value in (before_id, after_id, limit))
+                or (before_id and after_id)):
+            emit('message-history', {'success': False, 'error': 'Invalid history request'})
+            return
+
+        emit('message-history', {
+            'success': True,
+            'before': before_id,
+            'after': after_id,
+            'messages': get_message_history(before_id, after_id, limit)
+        })
+
+    except Exception as e:
+        logging.exception("Unexpected error in fetching message history")
+        emit('message-history', {'success': False, 'error': 'An unexpected error occurred fetching message history'})
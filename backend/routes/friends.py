@@ -1,11 +1,18 @@
 from flask import Blueprint, request, jsonify
-from extensions import csrf, limiter, socketio
-from token_utils import token_required
+from extensions import csrf, limiter, socketio, presence_registry, friend_suggestion_cache
+from token_utils import token_required, ops_only
+from sockets import user_room, user_rooms
 import crud
 import logging
 
 friends_bp = Blueprint('friends', __name__, url_prefix='/friends')
 
+def push_pending_requests(user_id, count=None):
+    """Send the user's pending friend request count to every socket they have open, for the requests badge."""
+    if count is None:
+        count = crud.get_pending_request_count(user_id)
+    socketio.emit("pending-requests", {"count": count}, to=user_room(user_id))
+
 """ Friend and Friend Request Endpoints """
 @friends_bp.route('/make-request', methods=['POST'])
 @csrf.exempt
@@ -26,21 +33,25 @@ def make_request():
             logging.error(f"User {currentUser_username} tried to request a non-existent user: {receiver_username}")
             return jsonify({'error': 'User not found.'}), 404
         
-        if crud.check_friendship(currentUser_id, receiver.id):
+        relationship = crud.get_relationship_state(currentUser_id, receiver.id)
+        if relationship == "self":
+            logging.info(f"User {currentUser_username} attempted to friend themselves.")
+            return jsonify({'error': 'You cannot send a friend request to yourself.'}), 400
+        if relationship == "friend":
             logging.info(f"User {currentUser_username} attempted to re-friend {receiver_username}.")
             return jsonify({'error': 'You are already friends.'}), 400
-        if (crud.get_friend_requests(receiver_id=receiver.id, sender_id=currentUser_id, status="pending") or
-        crud.get_friend_requests(receiver_id=currentUser_id, sender_id=receiver.id, status="pending")):
+        if relationship in ("sent", "received"):
             logging.info(f"Duplicate friend request from {currentUser_username} to {receiver_username}.")
             return jsonify({'error': 'A friend request is already pending.'}), 400
         
-        crud.create_friend_request(currentUser_id, receiver.id)
+        pending_count = crud.create_friend_request(currentUser_id, receiver.id)
         logging.info(f"User {currentUser_username} sent a friend request to {receiver_username}.")
+        push_pending_requests(receiver.id, pending_count)
 
         socketio.emit("new-friend-request", {
             "requester": currentUser_username,
             "receiver": receiver_username
-        })
+        }, to=user_rooms(currentUser_id, receiver.id))
 
         return jsonify({'message': 'Friend request sent successfully!'})
     except Exception as e:
@@ -74,12 +85,13 @@ def accept_friend():
         
         crud.create_friendship(currentUser_id, friend.id)
         crud.delete_friend_request(friend_request[0].id)
+        push_pending_requests(currentUser_id)
 
         socketio.emit('new-friend', {
             "requester": friend.username,
             'receiver': {"id": currentUser_id, "username": currentUser_username}
             
-        })
+        }, to=user_rooms(currentUser_id, friend.id))
 
         logging.info(f"User {currentUser_username} accepted a friend request from {friend_username}.")
         return jsonify({'message': 'Friend request accepted successfully!', 'friend': {'id': friend.id, 'username': friend.username}})
@@ -112,11 +124,12 @@ def decline_friend():
             return jsonify({'error': 'No pending friend request found.'}), 404
 
         crud.delete_friend_request(friend_request[0].id)
+        push_pending_requests(user["user_id"])
 
         socketio.emit('declined-friend', {
             "requester": other_username,
             'receiver': currentUser_username
-        })
+        }, to=user_rooms(user["user_id"], other_user.id))
         
         logging.info(f"User {currentUser_username} declined a friend request from {other_username}.")
         return jsonify({'message': 'Friend request declined successfully!'})
@@ -149,7 +162,7 @@ def remove_friend():
             socketio.emit('removed-friend', {
                 'remover': {"id": user['user_id'], "username": currentUser_username},
                 'removed': friend_username,
-            })
+            }, to=user_rooms(user['user_id'], friend_user.id))
             logging.info(f"Friendship removed: {currentUser_username} -> {friend_username}")
             return jsonify({'message': 'Friend removed successfully!'}), 200
     
@@ -160,10 +173,46 @@ def remove_friend():
         logging.exception(f"Error in removing friend: {str(e)}")
         return jsonify({'error': 'An error occurred while removing the friend.'}), 500
     
+@friends_bp.route('/suggestions', methods=['GET'])
+@csrf.exempt
+@limiter.limit("20/minute")
+@token_required
+def get_suggestions():
+    """Suggest people the user may know, ranked by mutual friends."""
+    try:
+        user = request.user_payload
+        currentUser_id = user["user_id"]
+        if not user["isOnline"]:
+            logging.warning(f"Offline user {user['username']} attempted to view friend suggestions.")
+            return jsonify({'error': 'You are offline. Community features are not available.'}), 403
+
+        limit = min(max(request.args.get('limit', default=10, type=int), 1), 50)
+
+        suggestions = friend_suggestion_cache.get(currentUser_id, limit)
+        if suggestions is None:
+            cache_version = friend_suggestion_cache.version(currentUser_id)
+            suggestions = [
+                {'id': suggestion.id, 'username': suggestion.username, 'mutualFriends': suggestion.mutual_friends}
+                for suggestion in crud.get_friend_suggestions(currentUser_id, limit=limit)
+            ]
+            friend_suggestion_cache.set(currentUser_id, limit, suggestions, cache_version)
+
+        logging.info(f"User {user['username']} retrieved {len(suggestions)} friend suggestions.")
+        return jsonify({'suggestions': suggestions}), 200
+    except Exception as e:
+        logging.exception(f"Error fetching friend suggestions: {str(e)}")
+        return jsonify({'error': 'An error occurred while fetching friend suggestions.'}), 500
+
+@friends_bp.route('/suggestions/cache-stats', methods=['GET'])
+@token_required
+@ops_only
+def suggestion_cache_stats():
+    """Report hit/miss counters for this worker's friend suggestion cache."""
+    return jsonify(friend_suggestion_cache.stats())
+
 def get_friend_requests(user):
     try:
-        user_requests = crud.get_friend_requests(receiver_id=user["user_id"], status="pending")
-        sender_usernames = [request.sender.username for request in user_requests]
+        sender_usernames = crud.get_pending_requesters(user["user_id"])
 
         print("Got requests: ", sender_usernames)
 
@@ -174,15 +223,14 @@ def get_friend_requests(user):
     
 def get_friends(user):
     try:
-        friendships = crud.get_friends(user["user_id"])
-
         friend_list = [
             {
                 'id': friend.id,
-                'username': friend.username
+                'username': friend.username,
+                # The registry has current status for anyone active since startup; the saved flag covers the rest
+                'isOnline': presence_registry.peek(friend.id, default=friend.isOnline)
             }
-            for friendship in friendships
-            for friend in [crud.get_user(id=friendship.user1_id if friendship.user1_id != user["user_id"] else friendship.user2_id)]
+            for friend in crud.get_friend_list(user["user_id"])
         ]
 
         logging.info(f"Friend list retrieved for user: ({len(friend_list)} friends)")
@@ -1,11 +1,18 @@
-from flask import Blueprint, request, jsonify
-from extensions import csrf, limiter
-from token_utils import token_required
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from extensions import csrf, limiter, product_listing_cache
+from token_utils import token_required, ops_only
+from model import Products
 import crud
 import logging
+import product_io
 import re
 
 products_bp = Blueprint('products', __name__, url_prefix='/products')
+
+IMPORT_BATCH_SIZE = 500
+MAX_REPORTED_IMPORT_ERRORS = 100
+MAX_BATCH_PRODUCT_IDS = 500
+BATCH_OPERATIONS = {"delete", "favorite", "unfavorite", "recategorize"}
     
 @products_bp.route("/submit-product", methods=["POST"])
 @csrf.exempt
@@ -42,6 +49,88 @@ def save():
         logging.exception("Error saving product for user %s", currentUser_id)
         return jsonify({"error": "An error occurred while adding the product", "details": str(e)}), 500
 
+@products_bp.route("/import", methods=["POST"])
+@csrf.exempt
+@token_required
+@limiter.limit("2/minute")
+def importProducts():
+    """
+    Import products from a CSV or NDJSON request body.
+
+    The body is read a row at a time and valid rows are inserted in batches of
+    IMPORT_BATCH_SIZE, each committed on its own, so the upload is never held in memory.
+    Invalid rows are skipped and reported by line number.
+    """
+    imported = 0
+    try:
+        user = request.user_payload
+        currentUser_id = user['user_id']
+        logging.info("User %s is importing products", currentUser_id)
+
+        file_format = request.args.get('format', default=None, type=str) or product_io.format_from_mimetype(request.mimetype)
+        if file_format not in product_io.IMPORT_FORMATS:
+            return jsonify({"error": "Upload must be CSV or NDJSON"}), 400
+
+        failed = 0
+        errors = []
+        batch = []
+
+        for line_number, row in product_io.read_import_rows(request.stream, file_format):
+            try:
+                batch.append(product_io.parse_product_row(row))
+            except ValueError as e:
+                failed += 1
+                if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += crud.bulk_create_products(currentUser_id, batch)
+                batch = []
+
+        imported += crud.bulk_create_products(currentUser_id, batch)
+
+        logging.info("User %s imported %s products (%s rows rejected)", currentUser_id, imported, failed)
+        return jsonify({
+            "message": "Import finished",
+            "imported": imported,
+            "failed": failed,
+            "errors": errors,
+            "errorsTruncated": failed > len(errors)
+        })
+
+    except UnicodeDecodeError:
+        logging.warning("User %s uploaded an import that is not UTF-8", currentUser_id)
+        return jsonify({"error": "Upload must be UTF-8 encoded", "imported": imported}), 400
+    except Exception as e:
+        logging.exception("Error importing products for user %s", currentUser_id)
+        return jsonify({"error": "Failed to import products", "details": str(e), "imported": imported}), 500
+
+@products_bp.route("/export", methods=["GET"])
+@token_required
+@limiter.limit("5/minute")
+def exportProducts():
+    """Stream all of the user's products as a CSV or NDJSON download."""
+    try:
+        user = request.user_payload
+        currentUser_id = user['user_id']
+        logging.info("User %s is exporting their products", currentUser_id)
+
+        file_format = request.args.get('format', default='csv', type=str)
+        if file_format not in product_io.EXPORT_MIMETYPES:
+            return jsonify({"error": "Export format must be csv or ndjson"}), 400
+
+        rows = crud.iter_product_rows(currentUser_id)
+        return Response(
+            stream_with_context(product_io.export_lines(rows, file_format)),
+            mimetype=product_io.EXPORT_MIMETYPES[file_format],
+            headers={"Content-Disposition": f"attachment; filename=linkcart-products.{file_format}"}
+        )
+
+    except Exception as e:
+        logging.exception("Error exporting products for user %s", currentUser_id)
+        return jsonify({"error": "Failed to export products", "details": str(e)}), 500
+
 @products_bp.route("/delete-product", methods=["DELETE"])
 @csrf.exempt
 @token_required
@@ -57,16 +146,10 @@ def delete():
             logging.warning("User %s failed to provide a product ID for deletion", currentUser_id)
             return jsonify({"error": "Product ID is required"}), 400
 
-        product = crud.get_product_by_id(user_id=currentUser_id, id=productId)
-        if not product:
-            logging.warning("User %s attempted to delete a nonexistent product", currentUser_id)
+        if not crud.delete_product(productId, currentUser_id):
+            logging.warning("User %s attempted to delete a nonexistent or unauthorized product", currentUser_id)
             return jsonify({"error": "Product not found"}), 404
-        
-        if product.user_id != currentUser_id:
-            logging.warning("User %s attempted to delete an unauthorized product", currentUser_id)
-            return jsonify({"error": "Access denied"}), 403
 
-        crud.delete_product(productId)
         logging.info("User %s successfully deleted product %s", currentUser_id, productId)
 
         return jsonify({
@@ -92,42 +175,108 @@ def getProducts():
         category_filter = request.args.get('categoryFilter', default=None, type=str)
         page = request.args.get('page', default=1, type=int)
         limit = request.args.get('limit', default=10, type=int)
+        cursor = request.args.get('cursor', default=None, type=str)
+        include_total = request.args.get('includeTotal', default='true', type=str).lower() != 'false'
+        search = request.args.get('search', default='', type=str).strip()[:200] or None
         
         offset = (page - 1) * limit
 
-        total_products = crud.count_products(
-            user_id=currentUser_id,
-            min_price=min_price,
-            max_price=max_price,
-            category_filter=category_filter,
+        cache_key = (
+            sort_by,
+            extra_sort_by if sort_by in ('price', 'category') else None,
+            min_price,
+            max_price,
+            category_filter,
+            limit,
+            # With a cursor the offset still matters: list_products adds it back onto the total.
+            cursor,
+            offset,
+            search,
+            include_total,
         )
+        listing = product_listing_cache.get(currentUser_id, cache_key)
 
-        total_pages = (total_products + limit - 1) // limit
-
-        user_products = crud.get_products(
-            user_id=currentUser_id,
-            sort_by=sort_by,
-            extra_sort_by=extra_sort_by,
-            min_price=min_price,
-            max_price=max_price,
-            category_filter=category_filter,
-            limit=limit,
-            offset=offset
-        )
+        if listing is None:
+            cache_version = product_listing_cache.version(currentUser_id)
+
+            user_products, total_products, has_next = crud.list_products(
+                user_id=currentUser_id,
+                sort_by=sort_by,
+                extra_sort_by=extra_sort_by,
+                min_price=min_price,
+                max_price=max_price,
+                category_filter=category_filter,
+                limit=limit,
+                offset=offset,
+                cursor=cursor,
+                search=search,
+                include_total=include_total
+            )
 
-        user_products_data = [product.to_dict() for product in user_products]
+            total_pages = None
+            if total_products is not None:
+                total_pages = (total_products + limit - 1) // limit
+
+            next_cursor = None
+            if has_next:
+                next_cursor = crud.encode_product_cursor(user_products[-1], sort_by, extra_sort_by, search)
+
+            listing = {
+                "products": [Products.serialize_row(product) for product in user_products],
+                "totalPages": total_pages,
+                "hasNextPage": has_next,
+                "nextCursor": next_cursor
+            }
+            product_listing_cache.set(currentUser_id, cache_key, listing, cache_version)
 
         return jsonify({
             "message": "User products fetched successfully",
-            "products": user_products_data,
             "page": page,
-            "totalPages": total_pages
+            **listing
         })
 
+    except ValueError as e:
+        logging.warning("User %s sent an invalid product cursor: %s", currentUser_id, e)
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logging.exception("Error fetching products for user %s", currentUser_id)
         return jsonify({"error": "Failed to fetch products", "details": str(e)}), 500
 
+@products_bp.route("/facets", methods=["GET"])
+@token_required
+@limiter.limit("20/minute")
+def getFacets():
+    """Return per-category product counts and price ranges for the filter sidebar."""
+    try:
+        user = request.user_payload
+        currentUser_id = user['user_id']
+
+        facets = crud.get_category_facets(currentUser_id)
+
+        return jsonify({
+            "facets": [
+                {
+                    "category": facet.name,
+                    "count": facet.product_count,
+                    "minPrice": facet.min_price,
+                    "maxPrice": facet.max_price,
+                    "avgPrice": facet.price_total / facet.product_count
+                }
+                for facet in facets
+            ]
+        })
+
+    except Exception as e:
+        logging.exception("Error fetching category facets for user %s", currentUser_id)
+        return jsonify({"error": "Failed to fetch category facets", "details": str(e)}), 500
+
+@products_bp.route("/cache-stats", methods=["GET"])
+@token_required
+@ops_only
+def productCacheStats():
+    """Report hit/miss counters for this worker's product listing cache."""
+    return jsonify(product_listing_cache.stats())
+
 @products_bp.route("/edit-product", methods=["PUT"])
 @csrf.exempt
 @token_required
@@ -143,15 +292,6 @@ def editProduct():
             logging.warning("User %s failed to provide a product ID for editing", currentUser_id)
             return jsonify({"error": "Missing product or required fields"}), 400
 
-        product = crud.get_product_by_id(user_id=currentUser_id, product_id=product_id)
-        if not product:
-            logging.warning("User %s attempted to edit a nonexistent product", currentUser_id)
-            return jsonify({"error": "Product not found"}), 404
-        
-        if product.user_id != currentUser_id:
-            logging.warning("User %s attempted to edit an unauthorized product", currentUser_id)
-            return jsonify({"error": "Access denied"}), 403
-        
         price = request.json.get("price")
 
         if price is None:
@@ -159,6 +299,7 @@ def editProduct():
 
         updated_product = crud.update_product(
             product_id, 
+            currentUser_id,
             url=request.json.get("url"), 
             price=price, 
             productName=request.json.get("productName"), 
@@ -167,13 +308,11 @@ def editProduct():
         if updated_product:
             logging.info("User %s successfully edited product %s", currentUser_id, product_id)
             return jsonify({
-                "product": updated_product.to_dict()
+                "product": Products.serialize_row(updated_product)
             })
 
-        logging.error("Failed to edit product %s for user %s", product_id, currentUser_id)
-        return jsonify({
-            "error": 'Error occurred while updating product'
-        }), 400
+        logging.warning("User %s attempted to edit a nonexistent or unauthorized product", currentUser_id)
+        return jsonify({"error": "Product not found"}), 404
     except Exception as e:
         logging.exception("Error editing product for user %s", currentUser_id)
         return jsonify({"error": "Failed to edit product", "details": str(e)}), 500
@@ -191,25 +330,56 @@ def favoriteProduct():
             logging.warning("User %s failed to provide a product ID for favoriting", currentUser_id)
             return jsonify({"error": "Product ID is required"}), 400
         
-        product = crud.get_product_by_id(user_id=currentUser_id, product_id=productId)
-        if not product:
-            logging.warning("User %s attempted to favorite a nonexistent product", currentUser_id)
-            return jsonify({"error": "Product not found"}), 404
-        
-        if product.user_id != currentUser_id:
-            logging.warning("User %s attempted to favorite an unauthorized product", currentUser_id)
-            return jsonify({"error": "Access denied"}), 403
-        
-        updated_product = crud.toggle_favorited(productId)
+        updated_product = crud.toggle_favorited(productId, currentUser_id)
         if updated_product:
             logging.info("User %s successfully favorited product %s", currentUser_id, productId)
             return jsonify({
                     "favorited": updated_product.favorited
             })
-        logging.error("Failed to favorite product %s for user %s", productId, currentUser_id)
-        return jsonify({
-            "error": "Product favoriting process failed"
-        }), 400
+        logging.warning("User %s attempted to favorite a nonexistent or unauthorized product", currentUser_id)
+        return jsonify({"error": "Product not found"}), 404
     except Exception as e:
         logging.exception("Error favoriting product for user %s", currentUser_id)
-        return jsonify({"error": "Failed to toggle favorite", "details": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to toggle favorite", "details": str(e)}), 500
+
+@products_bp.route("/batch", methods=["POST"])
+@csrf.exempt
+@token_required
+@limiter.limit("10/minute")
+def batchProducts():
+    """Apply one operation to several of the user's products at once."""
+    try:
+        user = request.user_payload
+        currentUser_id = user['user_id']
+
+        operation = request.json.get("operation")
+        product_ids = request.json.get("ids")
+        logging.info("User %s is applying batch operation %s", currentUser_id, operation)
+
+        if operation not in BATCH_OPERATIONS:
+            return jsonify({"error": "Unknown batch operation"}), 400
+        if (not isinstance(product_ids, list) or not product_ids
+                or not all(isinstance(product_id, int) and not isinstance(product_id, bool) for product_id in product_ids)):
+            return jsonify({"error": "ids must be a non-empty list of product IDs"}), 400
+        if len(product_ids) > MAX_BATCH_PRODUCT_IDS:
+            return jsonify({"error": f"At most {MAX_BATCH_PRODUCT_IDS} products can be changed at once"}), 400
+
+        if operation == "delete":
+            deleted_ids = crud.batch_delete_products(currentUser_id, product_ids)
+            logging.info("User %s batch deleted %s products", currentUser_id, len(deleted_ids))
+            return jsonify({"deleted": deleted_ids})
+
+        if operation == "recategorize":
+            categories = request.json.get("category")
+            if not isinstance(categories, list) or not all(isinstance(name, str) for name in categories):
+                return jsonify({"error": "category must be a list of category names"}), 400
+            updated = crud.batch_set_categories(currentUser_id, product_ids, categories)
+        else:
+            updated = crud.batch_set_favorited(currentUser_id, product_ids, operation == "favorite")
+
+        logging.info("User %s batch updated %s products", currentUser_id, len(updated))
+        return jsonify({"products": [Products.serialize_row(row) for row in updated]})
+
+    except Exception as e:
+        logging.exception("Error applying batch operation for user %s", currentUser_id)
+        return jsonify({"error": "Failed to apply batch operation", "details": str(e)}), 500
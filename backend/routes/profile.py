@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from extensions import csrf, limiter
 from token_utils import token_required
+from model import Products
+from routes.friends import push_pending_requests
 import crud
 import logging
 
@@ -23,35 +25,22 @@ def profile(username):
             logging.warning(f"User {currentUser_username} attempted to access profiles while offline.")
             return jsonify({'error': 'You are offline. Community features are not available.'}), 403
 
-        target_user = crud.get_user(username=username)
-        if not target_user:
+        # User, relationship and favorites all come back from a single query
+        profile = crud.get_profile(currentUser_id, username)
+        if not profile:
             logging.error(f"Profile for username {username} not found.")
             return jsonify({'error': 'User not found'}), 404
 
-        is_friend = False
-        sent_request = False
-        received_request = False
-
-        if target_user.id != currentUser_id:
-            if crud.check_friendship(target_user.id, currentUser_id):
-                is_friend = True
-            elif crud.get_friend_requests(receiver_id=target_user.id, sender_id=currentUser_id, status='pending'):
-                sent_request = True
-            elif crud.get_friend_requests(receiver_id=currentUser_id, sender_id=target_user.id, status='pending'):
-                received_request = True
-
-        favorited_products = crud.get_favorited_products(user_id=target_user.id)
-
         logging.info(f"User {currentUser_username} successfully fetched profile data for {username}")
         return jsonify({
-            'favoriteProducts': [product.to_dict() for product in favorited_products],
+            'favoriteProducts': [Products.serialize_row(product) for product in profile.favorites],
             'user': {
-                "username": target_user.username,
-                "description": target_user.description
+                "username": profile.username,
+                "description": profile.description
             },
-            'isFriend': is_friend,
-            'sentRequest': sent_request,
-            'receivedRequest': received_request
+            'isFriend': profile.relationship == "friend",
+            'sentRequest': profile.relationship == "sent",
+            'receivedRequest': profile.relationship == "received"
         })
 
     except Exception as e:
@@ -111,6 +100,9 @@ def delete_user():
         if not response.get("success"):
             logging.warning(f"Failed to delete account for {currentUser_username}: {response['message']}")
             return jsonify(response), 404 if response["message"] == "User not found" else 400
+        # Requests the user had sent are gone, so update their receivers' badges
+        for receiver_id, count in response.pop("pending_request_counts").items():
+            push_pending_requests(receiver_id, count)
         logging.info(f"User {currentUser_username} successfully deleted their account.")
         return jsonify(response), 200
 
@@ -20,10 +20,11 @@ def check_user():
         user_id = user["user_id"]
         username = user["username"]
         
-        pending_request = True if crud.get_friend_requests(receiver_id=user_id) else False
+        # Later changes to the count are pushed over the socket as "pending-requests" events
+        pending_count = crud.get_pending_request_count(user_id)
 
         logging.info(f"User check successful for user {username}")
-        return jsonify({"user": username, "hasNewRequests": pending_request})
+        return jsonify({"user": username, "hasNewRequests": pending_count > 0, "pendingRequestCount": pending_count})
 
     except Exception as e:
         logging.exception("Unexpected error in /current-user")
@@ -2,12 +2,16 @@
     Script to seed database.
     You'll have to enter the password to your server twice to have your database perform the drop and create db.
     After doing that and no errors pop up, you're good to run.
+    Set SEED_CROWD=1 to also give alice 1800 friends and 200 pending requests, for checking friend list queries at scale.
 """
 
 import os
 from datetime import datetime, timedelta
+from sqlalchemy import insert, update
+from werkzeug.security import generate_password_hash
+import migrations
 import model
-from model import db, User, Products, CommunityMessage, FriendRequest, Friends
+from model import db, User, CommunityMessage, FriendRequest, Friends
 import server
 import crud
 
@@ -27,21 +31,20 @@ with server.app.app_context():
 
     def create_products(alice_id, bob_id, charlie_id):
         """Create sample products for users."""
-        products = [
-            Products(user_id=alice_id, url=f"https://example.com/product{i}", price=10.99 + i, 
-                     productName=f"Widget {chr(65 + i)}", category=["Gadgets"], favorited=i % 2 == 0)
+        crud.bulk_create_products(alice_id, [
+            dict(url=f"https://example.com/product{i}", price=10.99 + i, productName=f"Widget {chr(65 + i)}",
+                 category=["Gadgets"], favorited=i % 2 == 0)
             for i in range(1, 15)
-        ]
-        
-        products.extend([
-            Products(user_id=bob_id, url="https://example.com/product6", price=34.99, productName="Widget H", category=["Gadgets"], favorited=True),
-            Products(user_id=bob_id, url="https://example.com/product7", price=64.99, productName="Widget J", category=["Electronics", "Accessories"], favorited=False),
-            Products(user_id=charlie_id, url="https://example.com/product8", price=54.99, productName="Widget I", category=["Tools"], favorited=False),
-            Products(user_id=charlie_id, url="https://example.com/product9", price=74.99, productName="Widget K", category=["Tools", "Home"], favorited=True)
         ])
 
-        db.session.add_all(products)
-        db.session.commit()
+        crud.bulk_create_products(bob_id, [
+            dict(url="https://example.com/product6", price=34.99, productName="Widget H", category=["Gadgets"], favorited=True),
+            dict(url="https://example.com/product7", price=64.99, productName="Widget J", category=["Electronics", "Accessories"], favorited=False),
+        ])
+        crud.bulk_create_products(charlie_id, [
+            dict(url="https://example.com/product8", price=54.99, productName="Widget I", category=["Tools"], favorited=False),
+            dict(url="https://example.com/product9", price=74.99, productName="Widget K", category=["Tools", "Home"], favorited=True)
+        ])
 
     def create_community_messages(alice_id, bob_id, charlie_id):
         """Create 30 community messages to test pagination."""
@@ -55,20 +58,42 @@ with server.app.app_context():
 
     def create_friend_requests(alice_id, bob_id):
         """Create sample friend requests."""
-        friend_request1 = FriendRequest(sender_id=alice_id, receiver_id=bob_id, status="pending", timestamp=datetime.now())
-        db.session.add(friend_request1)
-        db.session.commit()
+        crud.create_friend_request(alice_id, bob_id)
 
     def create_friendship(alice_id, charlie_id):
         """Create sample friendships."""
-        friendship1 = Friends(user1_id=alice_id, user2_id=charlie_id)
+        friendship1 = Friends(user1_id=min(alice_id, charlie_id), user2_id=max(alice_id, charlie_id))
         db.session.add(friendship1)
         db.session.commit()
 
+    def create_crowd(alice_id, count=2000):
+        """Create many users who are friends with alice, a tenth of them with pending requests to her, for checking that friend lists don't query per friend."""
+        password = generate_password_hash("crowdpass", method='pbkdf2:sha256')
+        crowd_ids = db.session.execute(
+            insert(User).returning(User.id),
+            [dict(username=f"crowd{i}", email=f"crowd{i}@example.com", password=password, isOnline=i % 3 == 0) for i in range(count)]
+        ).scalars().all()
+
+        friends, requesters = crowd_ids[:count - count // 10], crowd_ids[count - count // 10:]
+        db.session.execute(insert(Friends), [
+            dict(user1_id=min(alice_id, friend_id), user2_id=max(alice_id, friend_id)) for friend_id in friends
+        ])
+        db.session.execute(insert(FriendRequest), [
+            dict(sender_id=requester_id, receiver_id=alice_id, status="pending", timestamp=datetime.now())
+            for requester_id in requesters
+        ])
+        db.session.execute(
+            update(User).where(User.id == alice_id).values(pending_request_count=User.pending_request_count + len(requesters))
+        )
+        db.session.commit()
+
     db.create_all()
+    migrations.upgrade(db.engine)
 
     alice, bob, charlie = create_users()
     create_products(alice.id, bob.id, charlie.id)
     create_community_messages(alice.id, bob.id, charlie.id)
     create_friend_requests(alice.id, bob.id)
-    create_friendship(alice.id, charlie.id)
\ No newline at end of file
+    create_friendship(alice.id, charlie.id)
+    if os.getenv("SEED_CROWD") == "1":
+        create_crowd(alice.id)
@@ -10,7 +10,8 @@ import os
 
 from flask_cors import CORS
 
-from extensions import csrf, socketio, limiter, mail
+from extensions import csrf, socketio, limiter, mail, community_message_buffer, message_writer, broadcaster, presence_registry, connection_registry
+import crud
 
 app = Flask(__name__)
 # app.secret_key = 'dev' 
@@ -34,14 +35,32 @@ app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
 app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
 app.config["MAIL_DEFAULT_SENDER"] = os.getenv("MAIL_DEFAULT_SENDER", "noreply@linkcart.com")
 
+# Persist community messages in batches from a background task, spilling to disk until they are written
+app.config["COMMUNITY_WRITE_BEHIND"] = os.getenv("COMMUNITY_WRITE_BEHIND") == "1"
+app.config["COMMUNITY_SPILL_DIR"] = os.getenv("COMMUNITY_SPILL_DIR", "community_spill")
+
+# Seconds over which busy broadcasts are batched into one frame; 0 sends every event on its own
+app.config["SOCKET_COALESCE_TICK"] = float(os.getenv("SOCKET_COALESCE_TICK", "0.05"))
+
+# Online status lives in the presence registry: "local" to this process, or "redis" to share it between workers
+app.config["PRESENCE_BACKEND"] = os.getenv("PRESENCE_BACKEND", "local")
+app.config["PRESENCE_REDIS_URL"] = os.getenv("PRESENCE_REDIS_URL", "redis://localhost:6379/0")
+
+# Usernames allowed to read the process stats endpoints; empty turns them off
+app.config["OPS_USERNAMES"] = {name.strip() for name in os.getenv("OPS_USERNAMES", "").split(",") if name.strip()}
+
 csrf.init_app(app)
 socketio.init_app(app)
 limiter.init_app(app)
 mail.init_app(app)
+message_writer.init_app(app, bump_version=crud.bump_community_message_version)
+broadcaster.init_app(app)
+presence_registry.init_app(app, load_status=crud.get_user_online_status, save_statuses=crud.save_online_statuses)
+connection_registry.init_app(app)
 
 CORS(app, supports_credentials=True, origins=["http://localhost:3000"])
 
-from routes.auth import auth_bp
+from routes.auth import auth_bp, release_expired_socket
 from routes.community import community_bp
 from routes.friends import friends_bp
 from routes.products import products_bp
@@ -56,6 +75,24 @@ app.register_blueprint(products_bp)
 app.register_blueprint(profile_bp)
 app.register_blueprint(user_bp)
 
+def start_background_services():
+    """
+    Start the background tasks behind the extensions. Call once in each process that serves
+    requests, after connect_to_db; each start() ignores being called again.
+    """
+    if community_message_buffer.enabled:
+        from routes.community import load_recent_messages
+        with app.app_context():
+            load_recent_messages()
+    message_writer.start(socketio)
+    broadcaster.start()
+    presence_registry.start(socketio, on_expired=release_expired_socket)
+    connection_registry.start(socketio)
+
 if __name__ == "__main__":
     connect_to_db(app, echo=False)
+
+    # With debug on, this process only watches for changes and the reloader's child serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_services()
     socketio.run(app, debug=True, port=8000, host="localhost")
\ No newline at end of file
@@ -1,9 +1,34 @@
-from extensions import socketio
+from flask import request, current_app
+from flask_socketio import join_room
+from extensions import socketio, presence_registry, connection_registry
+from token_utils import verify_token, token_required
+
+def user_room(user_id):
+    """Room that every socket of a user joins, across all of their tabs."""
+    return f"user:{user_id}"
+
+def user_rooms(*user_ids):
+    """Rooms for emitting to several users at once; a socket in more than one still gets the event once."""
+    return [user_room(user_id) for user_id in user_ids]
 
 @socketio.on("connect")
 def handle_connect():
-    socketio.emit("server_ready", {"msg": "connected and acknowledged"})
+    token = request.cookies.get('jwtToken')
+    user = verify_token(token, current_app) if token else None
+    connection_registry.opened(request.sid, user)
+    if user:
+        join_room(user_room(user["user_id"]))
+        presence_registry.heartbeat(user["user_id"], request.sid)
+    socketio.emit("server_ready", {"msg": "connected and acknowledged"}, to=request.sid)
 
+@socketio.on("heartbeat")
+@token_required
+def handle_heartbeat(*args, **kwargs):
+    """Keep the socket registered in the presence registry; clients send this periodically."""
+    user = kwargs.get('user')
+    if user:
+        connection_registry.touched(request.sid, user)
+        presence_registry.heartbeat(user["user_id"], request.sid)
 
 @socketio.on_error()
 def handle_error(e):
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import listing_cache
+from listing_cache import ListingCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(listing_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_invalidate_hides_cached_result(clock):
+    cache = ListingCache(ttl=60)
+    cache.set(1, "page", "old", cache.version(1))
+
+    cache.invalidate(1)
+
+    assert cache.get(1, "page") is None
+
+
+def test_result_computed_before_invalidation_is_not_served_after_version_is_pruned(clock):
+    cache = ListingCache(ttl=60)
+
+    version = cache.version(1)
+    clock.now += 1
+    cache.invalidate(1)
+    # The slow query finishes after the invalidation and stores its stale result under the old version.
+    clock.now += 30
+    cache.set(1, "page", "stale", version)
+
+    # Another user's invalidation prunes user 1's version, putting them back on the default one.
+    clock.now += 31
+    cache.invalidate(2)
+    assert cache.stats()["trackedVersions"] == 1
+
+    assert cache.get(1, "page") is None
+
+
+def test_result_computed_after_pruning_is_served(clock):
+    cache = ListingCache(ttl=60)
+    cache.invalidate(1)
+    clock.now += 61
+    cache.invalidate(2)
+
+    cache.set(1, "page", "fresh", cache.version(1))
+
+    assert cache.get(1, "page") == "fresh"
+
+
+def test_entries_expire_ttl_after_the_version_was_read(clock):
+    cache = ListingCache(ttl=60)
+    version = cache.version(1)
+    clock.now += 50
+    cache.set(1, "page", "slow", version)
+
+    clock.now += 11
+
+    assert cache.get(1, "page") is None
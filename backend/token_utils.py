@@ -4,6 +4,7 @@ from flask_socketio import disconnect
 from functools import wraps
 import logging
 import jwt
+from extensions import presence_registry, connection_registry
 
 token_bp = Blueprint('token', __name__, url_prefix='/token')
 
@@ -110,7 +111,11 @@ def token_required(f):
             logging.warning("Invalid or expired token")
             return jsonify({"error": "Invalid or expired token"}), 401
 
+        # The token's isOnline is only as fresh as the token; the presence registry has the current status
+        user_payload["isOnline"] = presence_registry.is_online(user_payload["user_id"], default=user_payload.get("isOnline"))
+
         if request.path.startswith('/socket.io'):
+            connection_registry.touched(request.sid, user_payload)
             kwargs['user'] = user_payload
         else:
             request.user_payload = user_payload
@@ -119,6 +124,24 @@ def token_required(f):
 
     return decorated_function
 
+def ops_only(f):
+    """
+    Limit an operational endpoint, such as process stats, to the usernames listed in OPS_USERNAMES.
+
+    Goes under token_required. Everyone else gets a 404, so the endpoint doesn't advertise itself,
+    and with no usernames configured it is off entirely.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from flask import current_app
+
+        if request.user_payload["username"] not in current_app.config.get("OPS_USERNAMES", ()):
+            logging.warning(f"User {request.user_payload['username']} requested ops endpoint {request.path}")
+            return jsonify({"error": "Not found"}), 404
+        return f(*args, **kwargs)
+
+    return decorated_function
+
 @token_bp.route('/refresh', methods=['POST'])
 @token_required
 def refresh_token(user=None):
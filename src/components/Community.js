@@ -24,29 +24,36 @@ const Community = () => {
     }
   };
 
+  const toMessage = (data) => ({
+    id: data.id,
+    username: data.username,
+    content: data.content,
+    timestamp: data.timestamp,
+  });
+
   const handleNewMessage = (data) => {
     if (data.success) {
-      setMessages((prevMessages) => [
-        ...prevMessages,
-        {
-          id: data.id,
-          username: data.username,
-          content: data.content,
-          timestamp: data.timestamp,
-        },
-      ]);
+      setMessages((prevMessages) => [...prevMessages, toMessage(data)]);
     } else {
       alert(data.error);
     }
   };
 
+  // Busy periods arrive as one frame holding several messages, oldest first
+  const handleNewMessageBatch = (batch) => {
+    const received = batch.filter((data) => data.success).map(toMessage);
+    setMessages((prevMessages) => [...prevMessages, ...received]);
+  };
+
   useEffect(() => {
     fetchMessages();
 
     socket.on("message_response", handleNewMessage);
+    socket.on("message_response_batch", handleNewMessageBatch);
 
     return () => {
       socket.off("message_response");
+      socket.off("message_response_batch");
     };
   }, []);
 
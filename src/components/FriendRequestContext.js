@@ -9,14 +9,14 @@ export const FriendRequestProvider = ({ children }) => {
   const { currentUser } = useContext(UserContext);
 
   useEffect(() => {
-    socket.on("new-friend-request", (data) => {
-      if (data.receiver === currentUser) {
-        setPendingRequest(true);
-      }
-    });
+    // The server pushes the pending request count to this user's sockets whenever it changes.
+    const handlePendingRequests = (data) => {
+      setPendingRequest(data.count > 0);
+    };
+    socket.on("pending-requests", handlePendingRequests);
 
     return () => {
-      socket.off("new-friend-request");
+      socket.off("pending-requests", handlePendingRequests);
     };
   }, [currentUser]);
 
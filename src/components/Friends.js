@@ -2,14 +2,12 @@ import { useEffect, useState, useContext } from "react";
 import { Link } from "react-router-dom";
 import socket from "./socket";
 import { UserContext } from "./UserContext";
-import { FriendRequestContext } from "./FriendRequestContext";
 import { toast } from "react-toastify";
 
 const Friends = () => {
   const [friends, setFriends] = useState([]);
   const [friendRequests, setFriendRequests] = useState([]);
   const { currentUser } = useContext(UserContext);
-  const { setPendingRequest } = useContext(FriendRequestContext);
 
   useEffect(() => {
     const fetchFriendsAndFriendRequests = async () => {
@@ -52,7 +50,6 @@ const Friends = () => {
           }
           return prev;
         });
-        setPendingRequest(true);
       }
     });
     socket.on("new-friend", (data) => {
@@ -92,7 +89,6 @@ const Friends = () => {
           prev.filter((username) => username !== requester)
         );
         setFriends((prev) => [...prev, result.friend]);
-        setPendingRequest(false);
       } else {
         const errorData = await response.json();
         throw new Error(
@@ -123,7 +119,6 @@ const Friends = () => {
           prev.filter((username) => username !== requester)
         );
         toast.success(result.message);
-        setPendingRequest(false);
       } else {
         const errorData = await response.json();
         throw new Error(
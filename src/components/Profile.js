@@ -1,7 +1,6 @@
 import { useEffect, useState, useContext } from "react";
 import { useParams } from "react-router-dom";
 import { UserContext } from "./UserContext";
-import { FriendRequestContext } from "./FriendRequestContext";
 import socket from "./socket";
 import { toast } from "react-toastify";
 
@@ -17,7 +16,6 @@ const Profile = ({ handleDeleteAccount }) => {
   const [isEditing, setIsEditing] = useState(false);
   const [newDescription, setNewDescription] = useState("");
 
-  const { setPendingRequest } = useContext(FriendRequestContext);
 
   useEffect(() => {
     const fetchUserProfile = async () => {
@@ -54,7 +52,6 @@ const Profile = ({ handleDeleteAccount }) => {
     socket.on("new-friend-request", (data) => {
       if (data.receiver === currentUser && data.requester === username) {
         setReceivedRequest(true);
-        setPendingRequest(true);
       }
     });
     socket.on("new-friend", (data) => {
@@ -177,7 +174,6 @@ const Profile = ({ handleDeleteAccount }) => {
         toast.success(result.message);
         setIsFriend(true);
         setReceivedRequest(false);
-        setPendingRequest(false);
       } else {
         const errorData = await response.json();
         throw new Error(
@@ -206,7 +202,6 @@ const Profile = ({ handleDeleteAccount }) => {
         const result = await response.json();
         toast.success(result.message);
         setReceivedRequest(false);
-        setPendingRequest(false);
       } else {
         const errorData = await response.json();
         throw new Error(
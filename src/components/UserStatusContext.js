@@ -1,11 +1,17 @@
-import { createContext, useState, useEffect } from "react";
+import { createContext, useState, useEffect, useContext, useRef } from "react";
 import socket from "./socket";
 import { toast } from "react-toastify";
+import { UserContext } from "./UserContext";
 
 export const UserStatusContext = createContext();
 
+const HEARTBEAT_INTERVAL_MS = 30000;
+
 export const UserStatusProvider = ({ children }) => {
   const [isOnline, setIsOnline] = useState(false);
+  const { currentUser } = useContext(UserContext);
+  const currentUserRef = useRef(currentUser);
+  currentUserRef.current = currentUser;
 
   const syncStatus = async () => {
     try {
@@ -41,11 +47,21 @@ export const UserStatusProvider = ({ children }) => {
     }
   };
 
+  // Status updates also arrive for friends; only our own changes the toggle
   const changeStatus = (data) => {
-    setIsOnline(data.isOnline);
+    if (data.username === currentUserRef.current) {
+      setIsOnline(data.isOnline);
+    }
   };
 
   useEffect(() => {
+    // Keeps this socket registered as present; the server drops sockets that go quiet
+    const heartbeat = setInterval(() => {
+      if (socket.connected) {
+        socket.emit("heartbeat");
+      }
+    }, HEARTBEAT_INTERVAL_MS);
+
     socket.on("connect", () => {
       console.log("Socket connected:", socket.id);
       socket.emit("go-online");
@@ -59,19 +75,30 @@ export const UserStatusProvider = ({ children }) => {
       console.log("Server is now starting to disconnect", data);
     });
 
-    socket.on("disconnect", (reason) =>
-      console.log("Socket disconnected:", reason)
-    );
+    socket.on("disconnect", (reason) => {
+      console.log("Socket disconnected:", reason);
+      // The server closed this socket, e.g. reaped it as idle, and socket.io won't reconnect on its own.
+      // Syncing reconnects if the server still has us online, and otherwise shows the status it settled on.
+      if (reason === "io server disconnect") {
+        syncStatus();
+      }
+    });
 
     socket.on("status_update", (data) => {
       console.log("Received status update:", data);
       changeStatus(data);
     });
 
+    socket.on("status_update_batch", (batch) => {
+      console.log("Received status updates:", batch);
+      batch.forEach(changeStatus);
+    });
+
     socket.on("connect_error", (err) => {
       console.log("Connection error:", err);
     });
     return () => {
+      clearInterval(heartbeat);
       if (socket.connected) {
         console.log("Cleaning up socket on unmount");
         socket.disconnect();
@@ -79,6 +106,7 @@ export const UserStatusProvider = ({ children }) => {
       socket.off("connect");
       socket.off("disconnect");
       socket.off("status_update");
+      socket.off("status_update_batch");
       socket.off("connect_error");
       socket.off("server_ready");
     };